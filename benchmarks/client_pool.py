@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+"""
+Compares GET latency of pooled clients against a new client per call.
+
+Requires a local S3 stand-in (``make services`` starts localstack), so it
+runs from ``make perf-s3`` instead of ``make perf``:
+
+    python -m benchmarks.client_pool --endpoint http://localhost:4566
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from statistics import quantiles
+
+from aiobotocore.config import AioConfig
+from thumbor.config import Config
+from thumbor.context import Context
+
+from thumbor_aws.client_pool import close_clients
+from thumbor_aws.storage import Storage
+
+BUCKET = "thumbor-benchmark"
+KEY = "benchmark/image"
+
+
+def get_storage(endpoint: str) -> Storage:
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "foobar")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "foobar")
+    cfg = Config(
+        AWS_STORAGE_BUCKET_NAME=BUCKET,
+        AWS_STORAGE_S3_ENDPOINT_URL=endpoint,
+    )
+    return Storage(Context(config=cfg))
+
+
+async def read_object(client):
+    response = await client.get_object(Bucket=BUCKET, Key=KEY)
+    async with response["Body"] as stream:
+        await stream.read()
+
+
+async def unpooled_get(storage: Storage):
+    async with storage.session.create_client(
+        "s3",
+        region_name=storage.region_name,
+        endpoint_url=storage.endpoint_url,
+        config=AioConfig(**storage.botocore_options),
+    ) as client:
+        await read_object(client)
+
+
+async def pooled_get(storage: Storage):
+    # Not get_data, which would coalesce concurrent reads of KEY into one
+    async with storage.get_client() as client:
+        await read_object(client)
+
+
+async def measure(operation, storage: Storage, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await operation(storage)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(timed() for _ in range(requests)))
+    percentiles = quantiles(latencies, n=100)
+    return percentiles[49], percentiles[98]
+
+
+async def main(args):
+    storage = get_storage(args.endpoint)
+    try:
+        async with storage.get_client() as client:
+            try:
+                await client.create_bucket(Bucket=BUCKET)
+            except client.exceptions.BucketAlreadyOwnedByYou:
+                pass
+            await client.put_object(
+                Bucket=BUCKET, Key=KEY, Body=os.urandom(args.size)
+            )
+
+        for name, operation in (
+            ("client per call", unpooled_get),
+            ("pooled client", pooled_get),
+        ):
+            p50, p99 = await measure(
+                operation, storage, args.requests, args.concurrency
+            )
+            print(f"{name:>16}: p50={p50:8.2f}ms p99={p99:8.2f}ms")
+    finally:
+        await close_clients()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoint", default="http://localhost:4566")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+"""
+Compares the memory S3Client.get_body uses to read an object against
+reading it with a single stream.read(), as it used to.
+
+Bodies are streamed through aiohttp and aiobotocore as they are when
+read from S3, as network sized chunks arrive. Each read runs in a
+process of its own so that its peak RSS can be told apart. Runs
+without S3:
+
+    python -m benchmarks.get_body --output get_body.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess  # nosec
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Any, Dict
+
+from aiobotocore.response import StreamingBody
+from aiohttp import StreamReader
+from aiohttp.base_protocol import BaseProtocol
+from thumbor.context import Context
+
+from thumbor_aws.config import Config
+from thumbor_aws.s3_client import S3Client
+
+# Size of the chunks data arrives from the network in
+NETWORK_CHUNK_SIZE = 16 * 1024
+
+VARIANTS = ("read", "get_body")
+
+
+class Protocol(BaseProtocol):
+    """Protocol of a connection that stays open while the body is read"""
+
+    @property
+    def connected(self) -> bool:
+        return True
+
+
+class CountingStreamReader(StreamReader):
+    """Counts the buffers aiohttp hands out as the body is read"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counts = {"allocations": 0, "allocated_bytes": 0}
+
+    def _count(self, chunk: bytes) -> bytes:
+        if chunk:
+            self.counts["allocations"] += 1
+            self.counts["allocated_bytes"] += len(chunk)
+        return chunk
+
+    async def read(self, n: int = -1) -> bytes:
+        return self._count(await super().read(n))
+
+    async def readany(self) -> bytes:
+        return self._count(await super().readany())
+
+
+def get_response(body: bytes) -> Dict[str, Any]:
+    """GetObject response whose body is fed to aiohttp as it is read"""
+    loop = asyncio.get_running_loop()
+    reader = CountingStreamReader(Protocol(loop), 2**16, loop=loop)
+
+    async def feed():
+        view = memoryview(body)
+        for start in range(0, len(body), NETWORK_CHUNK_SIZE):
+            reader.feed_data(bytes(view[start : start + NETWORK_CHUNK_SIZE]))
+            await asyncio.sleep(0)
+        reader.feed_eof()
+
+    asyncio.ensure_future(feed())
+    raw = SimpleNamespace(content=reader, url="benchmark", close=lambda: None)
+    return {
+        "Body": StreamingBody(raw, len(body)),
+        "ContentLength": len(body),
+        "counts": reader.counts,
+    }
+
+
+async def read(variant: str, size: int, chunk_size: int) -> Dict[str, Any]:
+    client = S3Client(
+        Context(config=Config(AWS_BODY_READ_CHUNK_SIZE=chunk_size))
+    )
+    body = os.urandom(size)
+    response = get_response(body)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if variant == "read":
+        async with response["Body"] as stream:
+            data = await stream.read()
+    else:
+        data = await client.get_body(response)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert data == body
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "variant": variant,
+        "size": size,
+        "seconds": seconds,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": (rss_after - rss_before) * 1024,
+        "peak_traced_bytes": peak,
+        **response["counts"],
+    }
+
+
+def measure(variant: str, size: int, chunk_size: int) -> Dict[str, Any]:
+    """Runs a read in a new process, so that its peak RSS is its own"""
+    output = subprocess.run(  # nosec
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.get_body",
+            "--variant",
+            variant,
+            "--sizes",
+            str(size),
+            "--chunk-size",
+            str(chunk_size),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main(args):
+    print(
+        f"{'variant':<9} {'size':>10} {'peak RSS MB':>12} "
+        f"{'peak traced MB':>15} {'allocations':>12} {'ms':>8}"
+    )
+    results = []
+    for size in args.sizes:
+        for variant in VARIANTS:
+            result = measure(variant, size, args.chunk_size)
+            results.append(result)
+            print(
+                f"{variant:<9} {size:>10} "
+                f"{result['peak_rss_bytes'] / 1024 / 1024:>12.1f} "
+                f"{result['peak_traced_bytes'] / 1024 / 1024:>15.1f} "
+                f"{result['allocations']:>12} "
+                f"{result['seconds'] * 1000:>8.1f}"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(
+                {"chunk_size": args.chunk_size, "results": results},
+                output,
+                indent=2,
+            )
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(item) for item in value.split(",")],
+        default=[1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024],
+        help="Comma separated object sizes in bytes",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=Config().AWS_BODY_READ_CHUNK_SIZE,
+        help="AWS_BODY_READ_CHUNK_SIZE to read with",
+    )
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="File to write the results to as JSON")
+    arguments = parser.parse_args()
+
+    if arguments.variant:
+        print(
+            json.dumps(
+                asyncio.run(
+                    read(
+                        arguments.variant,
+                        arguments.sizes[0],
+                        arguments.chunk_size,
+                    )
+                )
+            )
+        )
+    else:
+        main(arguments)
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+"""
+Compares the time result storage spends building a result on each hit
+when the content type comes from S3 against sniffing it from the image.
+
+Runs without S3:
+
+    python -m benchmarks.result_storage_hit
+"""
+
+import argparse
+import os
+import timeit
+from datetime import datetime, timezone
+
+from thumbor.config import Config
+from thumbor.context import Context
+
+from thumbor_aws.result_storage import Storage
+from thumbor_aws.s3_client import S3Object
+
+IMAGES = {
+    "jpeg": ("image/jpeg", b"\xff\xd8"),
+    "webp": ("image/webp", b"RIFF\x00\x00\x00\x00WEBP"),
+    "tiff": ("image/tiff", b"\x4d\x4d\x00\x2a"),
+    "svg": ("image/svg+xml", b'<?xml version="1.0"?>' + b" " * 2048 + b"<svg"),
+}
+
+
+def main(args):
+    storage = Storage(Context(config=Config()))
+    last_modified = datetime.now(timezone.utc)
+
+    for name, (content_type, header) in IMAGES.items():
+        body = header + os.urandom(args.size)
+        stored = S3Object(
+            200, body, last_modified, {"ContentType": content_type}
+        )
+        sniffed = S3Object(200, body, last_modified)
+
+        timings = []
+        for data in (sniffed, stored):
+            seconds = min(
+                timeit.repeat(
+                    lambda data=data: storage._get_result(data),
+                    number=args.number,
+                    repeat=5,
+                )
+            )
+            timings.append(seconds / args.number * 1_000_000)
+
+        print(
+            f"{name:>5}: sniffed={timings[0]:7.2f}us "
+            f"stored={timings[1]:7.2f}us "
+            f"saved={timings[0] - timings[1]:7.2f}us per hit"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=64 * 1024)
+    main(parser.parse_args())
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+"""
+Measures throughput, latency and memory of the loader, storage and
+result storage against an in-memory S3 (thumbor_aws.testing), at several
+concurrency levels and object sizes.
+
+Runs without S3:
+
+    python -m benchmarks.throughput --output results.json
+
+Each run is written as JSON, so that runs can be compared over time.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from statistics import quantiles
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List
+
+from thumbor.config import Config
+from thumbor.context import Context
+
+from thumbor_aws import loader
+from thumbor_aws.client_pool import close_clients
+from thumbor_aws.result_storage import Storage as ResultStorage
+from thumbor_aws.storage import Storage
+from thumbor_aws.testing import FakeS3
+from thumbor_aws.utils import normalize_path
+from thumbor_aws.write_behind import flush_write_behind
+
+BENCHMARKS = (
+    "loader.load",
+    "storage.get",
+    "storage.put",
+    "result_storage.get",
+    "result_storage.put",
+)
+
+
+def get_context() -> Context:
+    cfg = Config(
+        AWS_LOADER_BUCKET_NAME="loader",
+        AWS_STORAGE_BUCKET_NAME="storage",
+        AWS_RESULT_STORAGE_BUCKET_NAME="result-storage",
+    )
+    return Context(config=cfg)
+
+
+def get_path(number: int) -> str:
+    return f"benchmark/{number}.jpg"
+
+
+def seed(fake: FakeS3, context: Context, body: bytes, keys: int):
+    """Stores the objects read by get and load benchmarks"""
+    storage = Storage(context)
+    result_storage = ResultStorage(context)
+    fake.create_bucket(storage.bucket_name)
+    fake.create_bucket(result_storage.bucket_name)
+    for number in range(keys):
+        path = get_path(number)
+        fake.put(
+            context.config.AWS_LOADER_BUCKET_NAME,
+            normalize_path(context, context.config.AWS_LOADER_ROOT_PATH, path),
+            body,
+            "image/jpeg",
+        )
+        fake.put(
+            storage.bucket_name,
+            storage.normalize_key(storage.root_path, path),
+            body,
+            "image/jpeg",
+        )
+        fake.put(
+            result_storage.bucket_name,
+            result_storage.normalize_key(result_storage.prefix, path),
+            body,
+            "image/jpeg",
+        )
+
+
+def get_operation(
+    name: str, context: Context, body: bytes, keys: int
+) -> Callable[[int], Awaitable[Any]]:
+    """Operation run by a benchmark for the n-th request"""
+
+    def get_result_storage(number: int) -> ResultStorage:
+        context.request = SimpleNamespace(
+            url=get_path(number % keys), accepts_webp=False
+        )
+        return ResultStorage(context)
+
+    async def load(number: int):
+        result = await loader.load(context, get_path(number % keys))
+        assert result.successful, result.error
+
+    async def storage_get(number: int):
+        assert await Storage(context).get(get_path(number % keys)) is not None
+
+    async def storage_put(number: int):
+        await Storage(context).put(get_path(number), body)
+
+    async def result_storage_get(number: int):
+        assert await get_result_storage(number).get() is not None
+
+    async def result_storage_put(number: int):
+        await get_result_storage(number + keys).put(body)
+
+    return {
+        "loader.load": load,
+        "storage.get": storage_get,
+        "storage.put": storage_put,
+        "result_storage.get": result_storage_get,
+        "result_storage.put": result_storage_put,
+    }[name]
+
+
+async def run(
+    operation: Callable[[int], Awaitable[Any]], concurrency: int, requests: int
+) -> Dict[str, Any]:
+    """Runs requests operations, concurrency at a time"""
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for number in pending:
+            start = time.perf_counter()
+            try:
+                await operation(number)
+            except Exception:  # pylint: disable=broad-except
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await flush_write_behind()
+    seconds = time.perf_counter() - start
+
+    percentiles = latencies * 99
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": seconds,
+        "ops_per_sec": requests / seconds,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+    }
+
+
+async def measure(args, name: str, concurrency: int, size: int) -> Dict[str, Any]:
+    fake = FakeS3(
+        latency=args.latency / 1000,
+        error_rate=args.error_rate,
+        seed=0,
+    )
+    context = get_context()
+    body = b"\xff\xd8" + os.urandom(size - 2)
+    seed(fake, context, body, args.keys)
+    operation = get_operation(name, context, body, args.keys)
+
+    with fake.installed():
+        await run(operation, concurrency, min(concurrency, args.requests))
+        fake.calls.clear()
+        result = await run(operation, concurrency, args.requests)
+        s3_requests = dict(fake.calls)
+
+        # Tracing allocations slows Python down, so it gets a run of its own
+        tracemalloc.start()
+        await run(operation, concurrency, max(concurrency, args.requests // 10))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await close_clients()
+
+    return {
+        "benchmark": name,
+        "concurrency": concurrency,
+        "size": size,
+        **result,
+        "peak_memory_bytes": peak,
+        "s3_requests": s3_requests,
+    }
+
+
+async def main(args) -> Dict[str, Any]:
+    results = []
+    print(
+        f"{'benchmark':<20} {'conc':>5} {'size':>9} {'ops/s':>10} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8} {'errors':>6}"
+    )
+    for name in args.benchmarks:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                result = await measure(args, name, concurrency, size)
+                results.append(result)
+                print(
+                    f"{name:<20} {concurrency:>5} {size:>9} "
+                    f"{result['ops_per_sec']:>10.1f} {result['p50_ms']:>8.2f} "
+                    f"{result['p99_ms']:>8.2f} "
+                    f"{result['peak_memory_bytes'] / 1024 / 1024:>8.1f} "
+                    f"{result['errors']:>6}"
+                )
+
+    return {
+        "started_at": args.started_at,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "settings": {
+            "requests": args.requests,
+            "keys": args.keys,
+            "latency_ms": args.latency,
+            "error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    def numbers(value: str) -> List[int]:
+        return [int(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--benchmarks",
+        type=lambda value: value.split(","),
+        default=list(BENCHMARKS),
+        help=f"Comma separated benchmarks to run, out of {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=numbers,
+        default=[1, 8, 64],
+        help="Comma separated numbers of concurrent requests",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=numbers,
+        default=[16 * 1024, 256 * 1024, 2 * 1024 * 1024],
+        help="Comma separated object sizes in bytes",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=1000, help="Requests per measurement"
+    )
+    parser.add_argument(
+        "--keys", type=int, default=64, help="Distinct objects read"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=1.0, help="Latency of S3 in ms"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of S3 requests failing with 503 SlowDown",
+    )
+    parser.add_argument("--output", help="File to write the results to as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    arguments = get_parser().parse_args()
+    arguments.started_at = datetime.now(timezone.utc).isoformat()
+    report = asyncio.run(main(arguments))
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {arguments.output}")
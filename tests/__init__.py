@@ -9,6 +9,7 @@
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
 import os
+from unittest.mock import Mock
 
 from thumbor.config import Config
 from thumbor.context import Context, ServerParameters
@@ -16,11 +17,19 @@ from thumbor.importer import Importer
 from thumbor.testing import TestCase
 
 import thumbor_aws.s3_client
+from thumbor_aws.client_pool import close_clients
+from thumbor_aws.testing import FakeS3
+from thumbor_aws.write_behind import flush_write_behind
 
 
 class BaseS3TestCase(TestCase):
     test_images = {}
 
+    def tearDown(self):
+        self.io_loop.run_sync(flush_write_behind)
+        self.io_loop.run_sync(close_clients)
+        super().tearDown()
+
     @property
     def bucket_name(self):
         """Name of the bucket to put test files in"""
@@ -116,7 +125,7 @@ class BaseS3TestCase(TestCase):
         server.security_key = "ACME-SEC"
         return Context(server, cfg, importer)
 
-    async def ensure_bucket(self):
+    async def ensure_bucket(self, bucket_name=None):
         """Ensures the test bucket is created"""
         s3client = thumbor_aws.s3_client.S3Client(self.context)
         if self.context.config.THUMBOR_AWS_RUN_IN_COMPATIBILITY_MODE is True:
@@ -128,7 +137,23 @@ class BaseS3TestCase(TestCase):
         async with s3client.get_client() as client:
             try:
                 await client.create_bucket(
-                    Bucket=self.bucket_name,
+                    Bucket=bucket_name or self.bucket_name,
                 )
             except client.exceptions.BucketAlreadyOwnedByYou:
                 pass
+
+
+class FakeS3TestCase(BaseS3TestCase):
+    """Runs against an in-memory S3 holding the storage and result buckets"""
+
+    def setUp(self):
+        super().setUp()
+        self.fake = FakeS3()
+        self.fake.create_bucket(self.context.config.AWS_STORAGE_BUCKET_NAME)
+        self.fake.create_bucket(
+            self.context.config.AWS_RESULT_STORAGE_BUCKET_NAME
+        )
+        installed = self.fake.installed()
+        installed.__enter__()
+        self.addCleanup(installed.__exit__, None, None, None)
+        self.context.metrics = Mock()
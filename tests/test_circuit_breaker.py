@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from uuid import uuid4
+
+from preggy import expect
+from tornado.testing import gen_test
+
+from tests import FakeS3TestCase
+from thumbor_aws.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    PROBES_TO_CLOSE,
+    CircuitBreaker,
+)
+from thumbor_aws.result_storage import Storage as ResultStorage
+
+
+class CircuitBreakerTestCase(TestCase):
+    def get_breaker(self) -> CircuitBreaker:
+        return CircuitBreaker(
+            "test", threshold=0.5, min_calls=10, slow_call=1, open_time=10
+        )
+
+    def test_opens_when_calls_fail(self):
+        """Verifies that the breaker opens once enough calls failed"""
+        breaker = self.get_breaker()
+        for failed in [False, True] * 4:
+            breaker.record(failed)
+        expect(breaker.state).to_equal(CLOSED)
+
+        breaker.record(False)
+        breaker.record(True)
+
+        expect(breaker.state).to_equal(OPEN)
+        expect(breaker.allow()).to_be_false()
+
+    def test_counts_slow_calls_and_server_errors_as_failures(self):
+        """Verifies which calls count as failed"""
+        breaker = self.get_breaker()
+
+        expect(breaker.is_failure(200, 0.1)).to_be_false()
+        expect(breaker.is_failure(404, 0.1)).to_be_false()
+        expect(breaker.is_failure(200, 1.5)).to_be_true()
+        expect(breaker.is_failure(503, 0.1)).to_be_true()
+        expect(breaker.is_failure("error", 0.1)).to_be_true()
+        expect(breaker.is_failure("timeout", 0.1)).to_be_true()
+        expect(breaker.is_failure("cancelled", 0.1)).to_be_false()
+
+    def test_lets_probes_through_after_open_time(self):
+        """
+        Verifies that a single probe per interval is let through once
+        the breaker has been open long enough, closing it if they succeed
+        """
+        breaker = self.get_breaker()
+        with patch("thumbor_aws.circuit_breaker.time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            for _ in range(10):
+                breaker.record(True)
+
+            monotonic.return_value = 111
+            expect(breaker.state).to_equal(HALF_OPEN)
+            expect(breaker.allow()).to_be_true()
+            expect(breaker.allow()).to_be_false()
+
+            for _ in range(PROBES_TO_CLOSE):
+                breaker.record(False)
+
+        expect(breaker.state).to_equal(CLOSED)
+
+    def test_opens_again_when_probe_fails(self):
+        """Verifies that a failed probe opens the breaker again"""
+        breaker = self.get_breaker()
+        with patch("thumbor_aws.circuit_breaker.time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            for _ in range(10):
+                breaker.record(True)
+            monotonic.return_value = 111
+            expect(breaker.allow()).to_be_true()
+
+            breaker.record(True)
+
+            expect(breaker.state).to_equal(OPEN)
+
+
+class ResultStorageCircuitBreakerTestCase(FakeS3TestCase):
+    def setUp(self):
+        super().setUp()
+        self.context.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_THRESHOLD = 0.5
+        self.context.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_MIN_CALLS = 4
+        self.context.config.AWS_RESULT_STORAGE_S3_ENDPOINT_URL = (
+            f"http://{uuid4()}"
+        )
+
+    @gen_test
+    async def test_skips_s3_while_failing(self):
+        """
+        Verifies that result storage stops calling S3 once it keeps
+        failing, treating reads as misses and skipping writes
+        """
+        self.context.request = Mock(url="/test/result")
+        storage = ResultStorage(self.context)
+        self.fake.fail("get_object", "InternalError", 500, count=4)
+        for _ in range(4):
+            with expect.error_to_happen(Exception):
+                await storage.get()
+        calls = sum(self.fake.calls.values())
+
+        expect(await storage.get()).to_be_null()
+        await storage.put(b"some data")
+
+        expect(sum(self.fake.calls.values())).to_equal(calls)
+        expect(storage.circuit_breaker.state).to_equal(OPEN)
+        self.context.metrics.incr.assert_any_call(
+            "result_storage.circuit_breaker.skipped"
+        )
+        self.context.metrics.incr.assert_any_call(
+            "result_storage.circuit_breaker.open"
+        )
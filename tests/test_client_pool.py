@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+from preggy import expect
+from tornado.testing import gen_test
+
+from tests import BaseS3TestCase
+from thumbor_aws.client_pool import close_clients, get_pool
+from thumbor_aws.result_storage import Storage as ResultStorage
+from thumbor_aws.storage import Storage
+
+
+class ClientPoolTestCase(BaseS3TestCase):
+    @gen_test
+    async def test_reuses_client_between_instances(self):
+        """
+        Verifies that two S3Clients with the same
+        configuration share a single client
+        """
+        async with Storage(self.context).get_client() as first:
+            async with Storage(self.context).get_client() as second:
+                expect(first).to_equal(second)
+
+        expect(get_pool().clients).to_length(1)
+
+    @gen_test
+    async def test_separates_clients_by_configuration(self):
+        """
+        Verifies that S3Clients with different
+        configuration get different clients
+        """
+        storage = Storage(self.context)
+        storage.configuration["endpoint_url"] = "http://127.0.0.1:4566"
+
+        async with storage.get_client() as first:
+            async with ResultStorage(self.context).get_client() as second:
+                expect(first).not_to_equal(second)
+
+    @gen_test
+    async def test_client_stays_open_after_use(self):
+        """Verifies that leaving the client context does not close it"""
+        await self.ensure_bucket()
+
+        async with Storage(self.context).get_client() as client:
+            pass
+
+        response = await client.list_objects_v2(
+            Bucket=self.bucket_name, MaxKeys=1
+        )
+        expect(response["ResponseMetadata"]["HTTPStatusCode"]).to_equal(200)
+
+    @gen_test
+    async def test_can_close_clients(self):
+        """Verifies that closing the pool discards its clients"""
+        async with Storage(self.context).get_client() as first:
+            pass
+
+        await close_clients()
+
+        async with Storage(self.context).get_client() as second:
+            expect(second).not_to_equal(first)
+
+    @gen_test
+    async def test_uses_transport_settings_of_subsystem(self):
+        """
+        Verifies that clients are configured with the
+        connection settings of their own subsystem
+        """
+        self.context.config.AWS_RESULT_STORAGE_READ_TIMEOUT = 2
+        self.context.config.AWS_RESULT_STORAGE_MAX_POOL_CONNECTIONS = 200
+        self.context.config.AWS_RESULT_STORAGE_ADDRESSING_STYLE = "path"
+
+        async with ResultStorage(self.context).get_client() as client:
+            expect(client.meta.config.read_timeout).to_equal(2)
+            expect(client.meta.config.max_pool_connections).to_equal(200)
+            expect(client.meta.config.s3["addressing_style"]).to_equal("path")
+
+        async with Storage(self.context).get_client() as client:
+            expect(client.meta.config.read_timeout).to_equal(30)
+
+    def test_uses_tc_aws_max_retry_in_compatibility_mode(self):
+        """Verifies that TC_AWS_MAX_RETRY is used in compatibility mode"""
+        self.context.config.THUMBOR_AWS_RUN_IN_COMPATIBILITY_MODE = True
+        self.context.config.TC_AWS_MAX_RETRY = 7
+
+        options = Storage(self.context).botocore_options
+
+        expect(options["retries"]["max_attempts"]).to_equal(7)
+
+    def test_keeps_max_attempts_when_tc_aws_max_retry_is_not_set(self):
+        """
+        Verifies that the default TC_AWS_MAX_RETRY of 0 does not turn
+        retries off in compatibility mode
+        """
+        self.context.config.THUMBOR_AWS_RUN_IN_COMPATIBILITY_MODE = True
+
+        options = Storage(self.context).botocore_options
+
+        expect(options["retries"]["max_attempts"]).to_equal(3)
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import asyncio
+from unittest import TestCase
+
+from preggy import expect
+
+from thumbor_aws.concurrency import ConcurrencyLimiter, get_limiter
+
+
+class ConcurrencyLimiterTestCase(TestCase):
+    def test_limits_requests_in_flight(self):
+        """Verifies that no more than limit requests run at once"""
+        limiter = ConcurrencyLimiter(limit=2, write_limit=0)
+        in_flight = []
+
+        async def request(write):
+            async with limiter.slot(write):
+                in_flight.append(limiter.active)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*(request(i % 2 == 0) for i in range(6)))
+
+        asyncio.run(run())
+
+        expect(max(in_flight)).to_equal(2)
+        expect(limiter.active).to_equal(0)
+
+    def test_limits_writes_in_flight(self):
+        """Verifies that writes are bound by write_limit but reads are not"""
+        limiter = ConcurrencyLimiter(limit=0, write_limit=1)
+        writes = []
+
+        async def request(write):
+            async with limiter.slot(write):
+                writes.append(limiter.active_writes)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*(request(True) for _ in range(3)))
+            await asyncio.gather(*(request(False) for _ in range(3)))
+            expect(limiter.active).to_equal(0)
+
+        asyncio.run(run())
+
+        expect(max(writes)).to_equal(1)
+
+    def test_starts_waiting_reads_before_writes(self):
+        """Verifies that reads queued after writes still run first"""
+        limiter = ConcurrencyLimiter(limit=1, write_limit=0)
+        order = []
+
+        async def request(name, write):
+            async with limiter.slot(write):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            first = asyncio.ensure_future(request("first", True))
+            await asyncio.sleep(0)
+            writes = [
+                asyncio.ensure_future(request(f"write{i}", True))
+                for i in range(2)
+            ]
+            await asyncio.sleep(0)
+            reads = [
+                asyncio.ensure_future(request(f"read{i}", False))
+                for i in range(2)
+            ]
+            await asyncio.gather(first, *writes, *reads)
+
+        asyncio.run(run())
+
+        expect(order).to_equal(["first", "read0", "read1", "write0", "write1"])
+
+    def test_frees_room_of_cancelled_waiters(self):
+        """Verifies that cancelling a waiting request doesn't leak room"""
+        limiter = ConcurrencyLimiter(limit=1, write_limit=0)
+
+        async def run():
+            await limiter.acquire(False)
+            waiting = asyncio.ensure_future(limiter.acquire(True))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            limiter.release(False)
+
+            await asyncio.wait_for(limiter.acquire(True), 1)
+
+        asyncio.run(run())
+
+        expect(limiter.active).to_equal(1)
+        expect(limiter.writes).to_be_empty()
+
+    def test_shares_limiter_per_loop(self):
+        """Verifies that a limiter is shared by callers in the same loop"""
+
+        async def run():
+            return (
+                get_limiter("storage", 2, 1),
+                get_limiter("storage", 2, 1),
+                get_limiter("loader", 2, 1),
+            )
+
+        storage, same, loader = asyncio.run(run())
+
+        expect(storage).to_equal(same)
+        expect(storage).not_to_equal(loader)
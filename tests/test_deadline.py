@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import asyncio
+import copy
+import time
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock
+from uuid import uuid4
+
+from preggy import expect
+from thumbor.loaders import LoaderResult
+from tornado.testing import gen_test
+
+from tests import FakeS3TestCase
+from thumbor_aws import loader
+from thumbor_aws.circuit_breaker import OPEN
+from thumbor_aws.result_storage import Storage as ResultStorage
+from thumbor_aws.storage import Storage
+from thumbor_aws.utils import normalize_path
+
+
+class DeadlineTestCase(FakeS3TestCase):
+    def setUp(self):
+        super().setUp()
+        self.context.request = Mock(url="/test/deadline")
+
+    @gen_test
+    async def test_optional_reads_miss_at_deadline(self):
+        """
+        Verifies that result storage reads still running at the
+        request's deadline are treated as misses
+        """
+        self.context.config.AWS_OPTIONAL_DEADLINE = 0.05
+        storage = ResultStorage(self.context)
+        await storage.put(b"some data")
+        self.fake.slow_down("get_object", 5)
+
+        start = time.perf_counter()
+        result = await storage.get()
+
+        expect(result).to_be_null()
+        expect(time.perf_counter() - start).to_be_lesser_than(1)
+        self.context.metrics.incr.assert_any_call(
+            "s3.result_storage.deadline_exceeded"
+        )
+
+    @gen_test
+    async def test_reads_cut_short_by_deadline_open_circuit_breaker(self):
+        """
+        Verifies that result storage reads given up on at the deadline
+        count as failures towards opening the circuit breaker
+        """
+        self.context.config.AWS_OPTIONAL_DEADLINE = 0.05
+        self.context.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_THRESHOLD = 0.5
+        self.context.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_MIN_CALLS = 4
+        self.context.config.AWS_RESULT_STORAGE_S3_ENDPOINT_URL = (
+            f"http://{uuid4()}"
+        )
+        storage = ResultStorage(self.context)
+        self.fake.slow_down("get_object", 5, count=4)
+
+        for _ in range(4):
+            # Each read stands for a request of its own
+            self.context.aws_request_started_at = None
+            expect(await storage.get()).to_be_null()
+
+        expect(storage.circuit_breaker.state).to_equal(OPEN)
+        self.context.metrics.incr.assert_any_call(
+            f"s3.result_storage.get_object.{storage.bucket_name}.status.timeout",
+            1,
+        )
+
+    @gen_test
+    async def test_shared_read_outlives_request_that_started_it(self):
+        """
+        Verifies that a read shared with other requests still serves
+        them once the request that started it is gone
+        """
+        await Storage(self.context).put("/test/deadline", b"some data")
+        first_context = copy.copy(self.context)
+        self.fake.slow_down("get_object", 0.1)
+        first = asyncio.ensure_future(
+            Storage(first_context).get("/test/deadline")
+        )
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(Storage(self.context).get("/test/deadline"))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        # As thumbor's handler does when its request finished
+        first_context.metrics = None
+
+        expect(await second).to_equal(b"some data")
+
+    @gen_test
+    async def test_does_not_share_cancelled_reads(self):
+        """
+        Verifies that a read cancelled by the last request waiting
+        for it is not shared with requests coming after
+        """
+        await Storage(self.context).put("/test/deadline", b"some data")
+        self.fake.slow_down("get_object", 0.1)
+        first = asyncio.ensure_future(Storage(self.context).get("/test/deadline"))
+        await asyncio.sleep(0.01)
+
+        first.cancel()
+        await asyncio.sleep(0)
+
+        expect(await Storage(self.context).get("/test/deadline")).to_equal(
+            b"some data"
+        )
+
+    @gen_test
+    async def test_optional_writes_are_skipped_at_deadline(self):
+        """Verifies that storage writes are given up on at the deadline"""
+        self.context.config.AWS_OPTIONAL_DEADLINE = 0.05
+        storage = Storage(self.context)
+        self.fake.slow_down("put_object", 5)
+
+        await storage.put("/test/deadline", b"some data")
+
+        expect(await storage.exists("/test/deadline")).to_be_false()
+
+    @gen_test
+    async def test_mandatory_reads_time_out_at_deadline(self):
+        """Verifies that the loader fails with a timeout at the deadline"""
+        self.context.config.AWS_MANDATORY_DEADLINE = 0.05
+        self.fake.put(
+            self.context.config.AWS_LOADER_BUCKET_NAME,
+            normalize_path(
+                self.context, self.context.config.AWS_LOADER_ROOT_PATH, "/test/deadline"
+            ),
+            b"some data",
+        )
+        self.fake.slow_down("get_object", 5)
+
+        result = await loader.load(self.context, "/test/deadline")
+
+        expect(result.successful).to_be_false()
+        expect(result.error).to_equal(LoaderResult.ERROR_TIMEOUT)
+
+    @gen_test
+    async def test_serves_disk_cache_when_revalidation_times_out(self):
+        """
+        Verifies that the loader serves its disk cache when the
+        source can't be revalidated by the deadline
+        """
+        self.context.config.AWS_MANDATORY_DEADLINE = 0.05
+        self.fake.put(
+            self.context.config.AWS_LOADER_BUCKET_NAME,
+            normalize_path(
+                self.context, self.context.config.AWS_LOADER_ROOT_PATH, "/test/deadline"
+            ),
+            b"some data",
+        )
+        with TemporaryDirectory() as directory:
+            self.context.config.AWS_LOADER_DISK_CACHE_ENABLED = True
+            self.context.config.AWS_LOADER_DISK_CACHE_PATH = directory
+            await loader.load(self.context, "/test/deadline")
+            self.context.aws_request_started_at = None
+            self.fake.slow_down("head_object", 5)
+
+            start = time.perf_counter()
+            result = await loader.load(self.context, "/test/deadline")
+
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(b"some data")
+        expect(time.perf_counter() - start).to_be_lesser_than(1)
+        expect(self.fake.calls["get_object"]).to_equal(1)
+
+    @gen_test
+    async def test_measures_deadline_from_request_start(self):
+        """
+        Verifies that time the request spent before calling S3
+        counts against its deadline
+        """
+        self.context.config.AWS_OPTIONAL_DEADLINE = 1
+        self.context.config.AWS_MANDATORY_DEADLINE = 5
+        self.context.request_handler = Mock()
+        self.context.request_handler.request.request_time.return_value = 2
+
+        expect(await ResultStorage(self.context).get()).to_be_null()
+        expect(self.fake.calls["get_object"]).to_equal(0)
+        time_left = loader.get_s3_client(self.context).get_time_left()
+        expect(time_left).to_be_greater_than(2.5)
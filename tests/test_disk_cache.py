@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from preggy import expect
+
+from thumbor_aws.disk_cache import DiskCache, get_disk_cache
+
+LAST_MODIFIED = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+class DiskCacheTestCase(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_can_get_stored_object(self):
+        """Verifies that data and LastModified can be read back"""
+        cache = DiskCache(self.directory.name, 100)
+        await cache.put("bucket", "key", b"data", LAST_MODIFIED)
+
+        data, last_modified = await cache.get("bucket", "key")
+
+        expect(data).to_equal(b"data")
+        expect(last_modified).to_equal(LAST_MODIFIED)
+
+    async def test_returns_none_for_unknown_object(self):
+        """Verifies that a miss returns None"""
+        cache = DiskCache(self.directory.name, 100)
+
+        expect(await cache.get("bucket", "key")).to_be_null()
+
+    async def test_can_store_empty_object(self):
+        """Verifies that empty objects can be cached"""
+        cache = DiskCache(self.directory.name, 100)
+        await cache.put("bucket", "key", b"", LAST_MODIFIED)
+
+        data, _ = await cache.get("bucket", "key")
+
+        expect(data).to_equal(b"")
+
+    async def test_evicts_least_recently_used(self):
+        """Verifies that the size budget evicts the oldest files"""
+        cache = DiskCache(self.directory.name, 10)
+        await cache.put("bucket", "a", b"123456", LAST_MODIFIED)
+
+        await cache.put("bucket", "b", b"123456", LAST_MODIFIED)
+
+        expect(await cache.get("bucket", "a")).to_be_null()
+        expect(await cache.get("bucket", "b")).not_to_be_null()
+
+    async def test_only_scans_directory_when_over_budget(self):
+        """
+        Verifies that the cache directory is scanned on the first
+        write and then only when the size budget is exceeded
+        """
+        cache = DiskCache(self.directory.name, 10)
+
+        with patch.object(cache, "_evict", wraps=cache._evict) as evict:
+            for key in "abcd":
+                await cache.put("bucket", key, b"123", LAST_MODIFIED)
+
+        expect(evict.call_count).to_equal(2)
+        expect(cache.size).to_be_lesser_than(10)
+        expect(await cache.get("bucket", "d")).not_to_be_null()
+
+    async def test_accounts_for_replaced_objects(self):
+        """Verifies that storing an object again does not count it twice"""
+        cache = DiskCache(self.directory.name, 10)
+        await cache.put("bucket", "a", b"123456", LAST_MODIFIED)
+
+        await cache.put("bucket", "a", b"1234", LAST_MODIFIED)
+
+        expect(cache.size).to_equal(4)
+
+    def test_shares_cache_per_path(self):
+        """Verifies that caches of the same path and budget are shared"""
+        cache = get_disk_cache(self.directory.name, 10)
+
+        expect(get_disk_cache(self.directory.name, 10)).to_equal(cache)
+        expect(get_disk_cache(self.directory.name, 20)).not_to_equal(cache)
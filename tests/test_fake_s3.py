@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+from unittest.mock import Mock
+from uuid import uuid4
+
+import pytest
+from preggy import expect
+from tornado.testing import gen_test
+
+from tests import FakeS3TestCase
+from thumbor_aws import loader
+from thumbor_aws.result_storage import Storage as ResultStorage
+from thumbor_aws.storage import Storage
+
+
+@pytest.mark.usefixtures("test_images")
+class FakeS3ExtensionsTestCase(FakeS3TestCase):
+    @gen_test
+    async def test_serves_storage_and_loader(self):
+        """
+        Verifies that images stored through the fake S3
+        can be read back by storage and the loader
+        """
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+
+        await storage.put(filepath, expected)
+        await storage.put_crypto(filepath)
+        result = await loader.load(self.context, filepath)
+
+        expect(await storage.get(filepath)).to_equal(expected)
+        expect(await storage.get_crypto(filepath)).to_equal("ACME-SEC")
+        expect(result.buffer).to_equal(expected)
+        expect(self.fake.calls["put_object"]).to_equal(2)
+
+    @gen_test
+    async def test_serves_result_storage(self):
+        """
+        Verifies that results stored through the fake S3
+        can be read back with their content type
+        """
+        self.context.request = Mock(url=f"/test/result_{uuid4()}")
+        storage = ResultStorage(self.context)
+        expected = self.test_images["default"]
+
+        await storage.put(expected)
+        result = await storage.get()
+
+        expect(result.buffer).to_equal(expected)
+        expect(result.metadata["ContentType"]).to_equal("image/jpeg")
+
+    @gen_test
+    async def test_injects_errors(self):
+        """Verifies that S3 errors can be injected"""
+        storage = Storage(self.context)
+        self.fake.fail("put_object", "SlowDown", 503)
+
+        with expect.error_to_happen(RuntimeError):
+            await storage.put("/test/failing", b"some data")
+
+        await storage.put("/test/failing", b"some data")
+        expect(await storage.exists("/test/failing")).to_be_true()
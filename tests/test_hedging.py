@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import time
+from unittest import TestCase
+
+from preggy import expect
+from tornado.testing import gen_test
+
+from tests import FakeS3TestCase
+from thumbor_aws.hedging import MIN_SAMPLES, HedgingPolicy
+from thumbor_aws.storage import Storage
+
+
+class HedgingPolicyTestCase(TestCase):
+    def test_uses_fixed_delay_until_enough_latencies(self):
+        """
+        Verifies that the percentile of recent latencies
+        replaces the fixed delay once enough were recorded
+        """
+        policy = HedgingPolicy(delay=0.5, percentile=90, budget=0.05)
+        for latency in range(MIN_SAMPLES - 1):
+            policy.record(latency / 1000)
+        expect(policy.get_delay()).to_equal(0.5)
+
+        policy.record(0.099)
+
+        expect(policy.get_delay()).to_equal(0.09)
+
+    def test_does_not_hedge_without_delay(self):
+        """Verifies that GETs are not hedged before a delay is known"""
+        policy = HedgingPolicy(delay=0, percentile=90, budget=0.05)
+
+        expect(policy.get_delay()).to_be_null()
+
+    def test_caps_hedges_to_budget(self):
+        """Verifies that only a budget share of GETs can be hedged"""
+        policy = HedgingPolicy(delay=0.1, percentile=0, budget=0.1)
+        hedges = 0
+        for _ in range(1000):
+            policy.start()
+            hedges += policy.try_hedge()
+
+        expect(hedges).to_be_lesser_or_equal_to(110)
+        expect(hedges).to_be_greater_than(90)
+
+
+class HedgedGetTestCase(FakeS3TestCase):
+    @gen_test
+    async def test_hedges_slow_gets(self):
+        """
+        Verifies that a GET slower than the hedge delay is sent
+        again and the fastest response is used
+        """
+        self.context.config.AWS_STORAGE_HEDGE_DELAY = 0.01
+        storage = Storage(self.context)
+        await storage.put("/test/hedged", b"some data")
+        self.fake.slow_down("get_object", 5)
+
+        start = time.perf_counter()
+        data = await storage.get("/test/hedged")
+
+        expect(data).to_equal(b"some data")
+        expect(time.perf_counter() - start).to_be_lesser_than(1)
+        expect(self.fake.calls["get_object"]).to_equal(2)
+        self.context.metrics.incr.assert_any_call(
+            "s3.storage.get_data.hedge.fired"
+        )
+        self.context.metrics.incr.assert_any_call("s3.storage.get_data.hedge.won")
+
+    @gen_test
+    async def test_does_not_hedge_fast_gets(self):
+        """Verifies that GETs answered within the delay are sent once"""
+        self.context.config.AWS_STORAGE_HEDGE_DELAY = 1
+        storage = Storage(self.context)
+        await storage.put("/test/hedged", b"some data")
+
+        data = await storage.get("/test/hedged")
+
+        expect(data).to_equal(b"some data")
+        expect(self.fake.calls["get_object"]).to_equal(1)
+
+    @gen_test
+    async def test_does_not_hedge_beyond_budget(self):
+        """Verifies that slow GETs are not hedged once the budget is spent"""
+        self.context.config.AWS_STORAGE_HEDGE_DELAY = 0.01
+        self.context.config.AWS_STORAGE_HEDGE_BUDGET = 0.001
+        storage = Storage(self.context)
+        storage.hedging_policy.tokens = 0
+        await storage.put("/test/hedged", b"some data")
+        self.fake.slow_down("get_object", 0.05)
+
+        data = await storage.get("/test/hedged")
+
+        expect(data).to_equal(b"some data")
+        expect(self.fake.calls["get_object"]).to_equal(1)
+        self.context.metrics.incr.assert_any_call(
+            "s3.storage.get_data.hedge.budget_exhausted"
+        )
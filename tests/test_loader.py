@@ -8,6 +8,9 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
+import asyncio
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 from uuid import uuid4
 
 import pytest
@@ -17,6 +20,7 @@ from tornado.testing import gen_test
 
 from tests import BaseS3TestCase
 import thumbor_aws.loader
+from thumbor_aws.s3_client import S3Client
 from thumbor_aws.storage import Storage
 
 
@@ -48,6 +52,119 @@ class LoaderTestCase(BaseS3TestCase):
         expect(result.metadata["size"]).to_equal(len(expected))
         expect(result.metadata["updated_at"]).not_to_be_null()
 
+    @gen_test
+    async def test_can_load_file_from_s3_in_ranges(self):
+        """
+        Verifies that an image can be loaded from S3
+        using concurrent ranged GETs
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_LOADER_RANGED_GET_PART_SIZE = 1000
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await storage.put(filepath, expected)
+
+        result = await thumbor_aws.loader.load(self.context, filepath)
+
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(expected)
+        expect(result.buffer).to_be_instance_of(bytes)
+        expect(result.metadata["size"]).to_equal(len(expected))
+
+    @gen_test
+    async def test_restarts_ranged_load_when_file_changes(self):
+        """
+        Verifies that a ranged load starts over when the
+        object changes after its first range was read
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_LOADER_RANGED_GET_PART_SIZE = 1000
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        original = self.test_images["default"]
+        changed = original[::-1]
+        await storage.put(filepath, original)
+        send = S3Client._send
+        replaced = []
+
+        async def replace_once(client, s3_client, operation, **settings):
+            if "IfMatch" in settings and not replaced:
+                replaced.append(True)
+                await storage.put(filepath, changed)
+            return await send(client, s3_client, operation, **settings)
+
+        with patch.object(S3Client, "_send", replace_once):
+            result = await thumbor_aws.loader.load(self.context, filepath)
+
+        expect(replaced).to_length(1)
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(changed)
+
+    @gen_test
+    async def test_can_load_file_from_s3_in_ranges_one_at_a_time(self):
+        """
+        Verifies that ranged GETs complete when the loader's
+        requests are limited to one at a time
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_LOADER_RANGED_GET_PART_SIZE = 1000
+        self.context.config.AWS_LOADER_MAX_CONCURRENT_REQUESTS = 1
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await storage.put(filepath, expected)
+
+        result = await asyncio.wait_for(
+            thumbor_aws.loader.load(self.context, filepath), 10
+        )
+
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(expected)
+
+    @gen_test
+    async def test_can_load_empty_file_from_s3_in_ranges(self):
+        """
+        Verifies that an empty object can be loaded
+        when ranged GETs are enabled
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_LOADER_RANGED_GET_PART_SIZE = 1000
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        await storage.put(filepath, b"")
+
+        result = await thumbor_aws.loader.load(self.context, filepath)
+
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(b"")
+
+    @gen_test
+    async def test_can_load_file_from_disk_cache(self):
+        """
+        Verifies that an image loaded once is served
+        from the disk cache while it is unchanged in S3
+        """
+        await self.ensure_bucket()
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await storage.put(filepath, expected)
+
+        with TemporaryDirectory() as directory:
+            self.context.config.AWS_LOADER_DISK_CACHE_ENABLED = True
+            self.context.config.AWS_LOADER_DISK_CACHE_PATH = directory
+            await thumbor_aws.loader.load(self.context, filepath)
+
+            with patch.object(
+                S3Client, "get_data", side_effect=AssertionError
+            ):
+                result = await thumbor_aws.loader.load(self.context, filepath)
+
+        expect(result.successful).to_be_true()
+        expect(result.buffer).to_equal(expected)
+        expect(result.metadata["updated_at"]).not_to_be_null()
+
     @gen_test
     async def test_result_false_when_file_not_in_s3(self):
         """
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import time
+from unittest import TestCase
+
+from preggy import expect
+
+from thumbor_aws.memory_cache import MemoryCache
+
+
+class MemoryCacheTestCase(TestCase):
+    def test_can_get_stored_entry(self):
+        """Verifies that a stored entry can be read back"""
+        cache = MemoryCache(max_size=100, max_entries=10)
+        cache.set("key", b"data", "meta", time.time() + 60)
+
+        expect(cache.get("key")).to_equal((b"data", "meta"))
+        expect(cache.hits).to_equal(1)
+
+    def test_counts_misses(self):
+        """Verifies that unknown keys are counted as misses"""
+        cache = MemoryCache(max_size=100, max_entries=10)
+
+        expect(cache.get("key")).to_be_null()
+        expect(cache.misses).to_equal(1)
+
+    def test_drops_expired_entries(self):
+        """Verifies that expired entries are not served"""
+        cache = MemoryCache(max_size=100, max_entries=10)
+        cache.set("key", b"data", None, time.time() - 1)
+
+        expect(cache.get("key")).to_be_null()
+        expect(cache.size).to_equal(0)
+
+    def test_evicts_least_recently_used_by_entries(self):
+        """Verifies that the entry limit evicts the oldest entry"""
+        cache = MemoryCache(max_size=100, max_entries=2)
+        cache.set("a", b"1", None, time.time() + 60)
+        cache.set("b", b"2", None, time.time() + 60)
+        cache.get("a")
+
+        evicted = cache.set("c", b"3", None, time.time() + 60)
+
+        expect(evicted).to_equal(1)
+        expect(cache.get("b")).to_be_null()
+        expect(cache.get("a")).not_to_be_null()
+        expect(cache.evictions).to_equal(1)
+
+    def test_evicts_by_size(self):
+        """Verifies that the size limit evicts entries"""
+        cache = MemoryCache(max_size=10, max_entries=10)
+        cache.set("a", b"123456", None, time.time() + 60)
+
+        cache.set("b", b"123456", None, time.time() + 60)
+
+        expect(len(cache)).to_equal(1)
+        expect(cache.size).to_equal(6)
+
+    def test_removes_matching_entries(self):
+        """Verifies that entries can be removed by a predicate on keys"""
+        cache = MemoryCache(max_size=100, max_entries=10)
+        cache.set("a/1", b"1", None, time.time() + 60)
+        cache.set("a/2", b"2", None, time.time() + 60)
+        cache.set("b/1", b"3", None, time.time() + 60)
+
+        removed = cache.remove_matching(lambda key: key.startswith("a/"))
+
+        expect(removed).to_equal(2)
+        expect(cache.get("a/1")).to_be_null()
+        expect(cache.get("b/1")).not_to_be_null()
+        expect(cache.size).to_equal(1)
+
+    def test_ignores_entries_bigger_than_cache(self):
+        """Verifies that an entry bigger than the cache is not stored"""
+        cache = MemoryCache(max_size=4, max_entries=10)
+
+        cache.set("a", b"123456", None, time.time() + 60)
+
+        expect(len(cache)).to_equal(0)
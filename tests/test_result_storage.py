@@ -8,7 +8,9 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
-from unittest.mock import Mock
+import asyncio
+import json
+from unittest.mock import Mock, patch
 from uuid import uuid4
 
 import pytest
@@ -17,7 +19,11 @@ from thumbor.config import Config
 from tornado.testing import gen_test
 
 from tests import BaseS3TestCase
+import thumbor_aws.loader
+from thumbor_aws.result_storage import REGENERATE_HEADER
 from thumbor_aws.result_storage import Storage as ResultStorage
+from thumbor_aws.storage import Storage
+from thumbor_aws.write_behind import flush_write_behind, get_write_behind_queue
 
 
 @pytest.mark.usefixtures("test_images")
@@ -124,6 +130,386 @@ class ResultStorageTestCase(BaseS3TestCase):
 
         expect(data).to_be_null()
 
+    @gen_test
+    async def test_get_returns_none_for_expired_result(self):
+        """
+        Verifies that Result Storage treats an
+        expired image as a miss
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        self.context.request = Mock(url=filepath)
+        self.context.config.STORAGE_EXPIRATION_SECONDS = 0
+        storage = ResultStorage(self.context)
+        await storage.put(self.test_images["default"])
+
+        data = await storage.get()
+
+        expect(data).to_be_null()
+
+    @gen_test
+    async def test_uses_stored_content_type(self):
+        """
+        Verifies that Result Storage takes the content type of
+        results from S3 instead of sniffing the image again
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        self.context.request = Mock(url=filepath)
+        storage = ResultStorage(self.context)
+        expected = self.test_images["default"]
+        await storage.put(expected)
+
+        with patch(
+            "thumbor_aws.result_storage.BaseEngine.get_mimetype",
+            side_effect=AssertionError("image was sniffed"),
+        ):
+            data = await ResultStorage(self.context).get()
+
+        expect(data.buffer).to_equal(expected)
+        expect(data.metadata["ContentType"]).to_equal("image/jpeg")
+        expect(len(data)).to_equal(len(expected))
+
+    @gen_test
+    async def test_can_get_result_from_memory_cache(self):
+        """
+        Verifies that Result Storage serves results
+        from the memory cache when it is enabled
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        self.context.request = Mock(url=filepath)
+        self.context.config.AWS_RESULT_STORAGE_MEMORY_CACHE_ENABLED = True
+        storage = ResultStorage(self.context)
+        expected = self.test_images["default"]
+        await storage.put(expected)
+        storage.get_data = Mock(side_effect=AssertionError("S3 was called"))
+
+        data = await storage.get()
+
+        expect(data).not_to_be_null()
+        expect(data.buffer).to_equal(expected)
+        expect(data.metadata["ContentType"]).to_equal("image/jpeg")
+
+    async def _put_result_from_loader(self, filepath: str) -> ResultStorage:
+        await self.ensure_bucket()
+        source_storage = Storage(self.context)
+        await self.ensure_bucket(source_storage.bucket_name)
+        await source_storage.put(filepath, self.test_images["default"])
+        await thumbor_aws.loader.load(self.context, filepath)
+        self.context.request = Mock(url=filepath)
+        self.context.config.AWS_RESULT_STORAGE_REVALIDATE_EXPIRED = True
+        storage = ResultStorage(self.context)
+        await storage.put(self.test_images["default"])
+        return storage
+
+    @gen_test
+    async def test_revalidates_expired_result_with_unchanged_source(self):
+        """
+        Verifies that an expired result is served again
+        when its source image did not change
+        """
+        storage = await self._put_result_from_loader(
+            f"/test/can_put_file_{uuid4()}"
+        )
+        storage._is_expired = Mock(side_effect=[True, False])
+
+        data = await storage.get()
+
+        expect(data).not_to_be_null()
+        expect(data.buffer).to_equal(self.test_images["default"])
+
+    @gen_test
+    async def test_misses_expired_result_removed_while_revalidating(self):
+        """
+        Verifies that an expired result removed before it could be
+        revalidated is a miss rather than an error
+        """
+        storage = await self._put_result_from_loader(
+            f"/test/can_put_file_{uuid4()}"
+        )
+        get_data = storage.get_data
+
+        async def get_data_and_remove(*args, **kwargs):
+            data = await get_data(*args, **kwargs)
+            await storage.remove_many([self.context.request.url])
+            return data
+
+        storage._is_expired = Mock(return_value=True)
+        storage.get_data = get_data_and_remove
+
+        data = await storage.get()
+
+        expect(data).to_be_null()
+
+    @gen_test
+    async def test_does_not_revalidate_expired_result_with_missing_source(
+        self,
+    ):
+        """
+        Verifies that an expired result is discarded
+        when its source image is gone
+        """
+        filepath = f"/test/can_put_file_{uuid4()}"
+        storage = await self._put_result_from_loader(filepath)
+        await Storage(self.context).remove(filepath)
+        storage._is_expired = Mock(return_value=True)
+
+        data = await storage.get()
+
+        expect(data).to_be_null()
+
+    @gen_test
+    async def test_can_put_file_in_s3_in_background(self):
+        """
+        Verifies that with write-behind enabled results
+        are uploaded to S3 by background workers
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        self.context.request = Mock(url=filepath)
+        self.context.metrics = Mock()
+        self.context.config.AWS_RESULT_STORAGE_WRITE_BEHIND_ENABLED = True
+        storage = ResultStorage(self.context)
+        expected = self.test_images["default"]
+
+        path = await storage.put(expected)
+        await storage.put(expected)
+
+        expect(path).to_equal(
+            f"https://{self.bucket_name}.s3.localhost.localstack.cloud:4566"
+            f"{self._prefix}/auto_webp{filepath}",
+        )
+        queue = get_write_behind_queue(1000, 4)
+        expect(queue.depth).to_equal(1)
+        await queue.flush()
+        data = await storage.get()
+        expect(data.buffer).to_equal(expected)
+        depths = [
+            item.args[1]
+            for item in self.context.metrics.timing.call_args_list
+            if item.args[0] == "result_storage.write_behind.depth"
+        ]
+        expect(depths).to_equal([1, 1, 0])
+
+    @gen_test
+    async def test_uploads_in_background_after_request_finished(self):
+        """
+        Verifies that results queued for upload by a request are
+        stored once the request finished and its context was cleared
+        """
+        await self.ensure_bucket()
+        await self.ensure_bucket(self.context.config.AWS_STORAGE_BUCKET_NAME)
+        filepath = f"test/can_put_file_{uuid4()}.jpg"
+        await Storage(self.context).put(filepath, self.test_images["default"])
+        self.context.config.RESULT_STORAGE_STORES_UNSAFE = True
+        self.context.config.AWS_RESULT_STORAGE_WRITE_BEHIND_ENABLED = True
+        self.context.config.AWS_RESULT_STORAGE_MAX_CONCURRENT_REQUESTS = 2
+        self.context.config.AWS_NEGATIVE_CACHE_TTL = 60
+
+        response = await self.async_fetch(f"/unsafe/10x10/{filepath}")
+        await flush_write_behind()
+
+        expect(response.code).to_equal(200)
+        self.context.request = Mock(
+            url=f"unsafe/10x10/{filepath}", accepts_webp=False
+        )
+        storage = ResultStorage(self.context)
+        key = storage.normalize_key(storage.prefix, self.context.request.url)
+        expect(storage._is_known_missing(storage.bucket_name, key)).to_be_false()
+        expect(await storage.get()).not_to_be_null()
+
+    @gen_test
+    async def test_can_redirect_to_presigned_url(self):
+        """
+        Verifies that with redirect mode results are served by
+        redirecting to a presigned URL that is reused
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_redirect_{uuid4()}"
+        self.context.request = Mock(url=filepath, max_age=None)
+        self.context.request_handler = Mock()
+        self.context.config.AWS_RESULT_STORAGE_REDIRECT_MODE = "presigned"
+        await ResultStorage(self.context).put(self.test_images["default"])
+
+        result = await ResultStorage(self.context).get()
+        await ResultStorage(self.context).get()
+
+        expect(result.buffer).to_equal(b"")
+        expect(result.last_modified).not_to_be_null()
+        self.context.request_handler.set_status.assert_called_with(302)
+        (first, second) = [
+            item.args
+            for item in self.context.request_handler.set_header.call_args_list
+        ]
+        expect(first).to_equal(second)
+        expect(first[0]).to_equal("Location")
+        expect(first[1]).to_include(f"{self._prefix}/auto_webp{filepath}?")
+        expect(first[1]).to_include("Signature=")
+
+    @gen_test
+    async def test_caches_redirects_while_presigned_url_is_valid(self):
+        """
+        Verifies that redirects to presigned URLs are not cached by
+        clients for longer than the URLs are valid
+        """
+        await self.ensure_bucket()
+        await self.ensure_bucket(self.context.config.AWS_STORAGE_BUCKET_NAME)
+        filepath = f"test/can_redirect_{uuid4()}.jpg"
+        await Storage(self.context).put(filepath, self.test_images["default"])
+        self.context.config.RESULT_STORAGE_STORES_UNSAFE = True
+        self.context.config.MAX_AGE = 86400
+        self.context.config.AWS_RESULT_STORAGE_REDIRECT_MODE = "presigned"
+        self.context.config.AWS_RESULT_STORAGE_PRESIGNED_URL_EXPIRATION = 600
+
+        generated = await self.async_fetch(f"/unsafe/10x10/{filepath}")
+        await flush_write_behind()
+        response = await self.http_client.fetch(
+            self.get_url(f"/unsafe/10x10/{filepath}"),
+            follow_redirects=False,
+            raise_error=False,
+        )
+
+        expect(generated.code).to_equal(200)
+        expect(generated.headers["Cache-Control"]).to_equal(
+            "max-age=86400,public"
+        )
+        expect(response.code).to_equal(302)
+        expect(response.headers["Location"]).to_include("Signature=")
+        expect(response.headers["Cache-Control"]).to_equal(
+            "max-age=600,public"
+        )
+
+    async def _make_bucket_public(self, storage: ResultStorage):
+        policy = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Principal": "*",
+                    "Action": "s3:GetObject",
+                    "Resource": f"arn:aws:s3:::{storage.bucket_name}/*",
+                }
+            ],
+        }
+        async with storage.get_client() as client:
+            await client.put_bucket_policy(
+                Bucket=storage.bucket_name, Policy=json.dumps(policy)
+            )
+
+    @gen_test
+    async def test_can_redirect_to_public_url(self):
+        """
+        Verifies that with public redirect mode results are served
+        by redirecting to their location
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_redirect_{uuid4()}"
+        self.context.request = Mock(url=filepath, max_age=None)
+        self.context.request_handler = Mock()
+        self.context.config.AWS_RESULT_STORAGE_REDIRECT_MODE = "public"
+        self.context.config.AWS_DEFAULT_LOCATION = (
+            "http://localhost:4566/{bucket_name}"
+        )
+        storage = ResultStorage(self.context)
+        await self._make_bucket_public(storage)
+        await storage.put(self.test_images["default"])
+
+        result = await storage.get()
+        self.context.request = Mock(url=f"/test/missing_{uuid4()}")
+        missing = await ResultStorage(self.context).get()
+
+        expect(result.buffer).to_equal(b"")
+        self.context.request_handler.set_header.assert_called_once()
+        name, location = self.context.request_handler.set_header.call_args.args
+        expect(name).to_equal("Location")
+        target = await self.http_client.fetch(location, raise_error=False)
+        expect(target.code).to_equal(200)
+        expect(target.body).to_equal(self.test_images["default"])
+        expect(missing).to_be_null()
+
+    @gen_test
+    async def test_serves_stale_result_while_regenerating_it(self):
+        """
+        Verifies that within the stale window expired results
+        are served and regenerated once in the background
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        self.context.request = Mock(url=filepath)
+        self.context.request_handler = Mock(
+            request=Mock(uri=filepath, headers={})
+        )
+        self.context.config.STORAGE_EXPIRATION_SECONDS = 0
+        self.context.config.AWS_RESULT_STORAGE_STALE_WHILE_REVALIDATE = 3600
+        await ResultStorage(self.context).put(self.test_images["default"])
+        regenerated = asyncio.Event()
+        requests = []
+
+        async def request_regeneration(_, url, headers):
+            requests.append((url, headers))
+            await regenerated.wait()
+
+        with patch.object(
+            ResultStorage, "_request_regeneration", request_regeneration
+        ):
+            results = await asyncio.gather(
+                ResultStorage(self.context).get(),
+                ResultStorage(self.context).get(),
+            )
+            await asyncio.sleep(0)
+            regenerated.set()
+
+        expect([result.buffer for result in results]).to_equal(
+            [self.test_images["default"]] * 2
+        )
+        expect(requests).to_length(1)
+        url, headers = requests[0]
+        expect(url).to_equal(f"http://127.0.0.1:8889{filepath}")
+        expect(headers).to_include(REGENERATE_HEADER)
+        self.context.request_handler.request.headers = headers
+        expect(await ResultStorage(self.context).get()).to_be_null()
+
+    @gen_test
+    async def test_can_purge_results(self):
+        """
+        Verifies that results of every URL under a prefix are
+        removed, with and without auto webp
+        """
+        await self.ensure_bucket()
+        directory = f"/test/purge_{uuid4()}"
+        for accepts_webp in (True, False):
+            self.context.request = Mock(
+                url=f"{directory}/a", accepts_webp=accepts_webp
+            )
+            await ResultStorage(self.context).put(self.test_images["default"])
+
+        deleted = await ResultStorage(self.context).purge(directory)
+
+        expect(deleted).to_equal(2)
+        expect(await ResultStorage(self.context).get()).to_be_null()
+
+    @gen_test
+    async def test_removes_results_from_memory_cache(self):
+        """
+        Verifies that removed and purged results are
+        not served from the memory cache anymore
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_RESULT_STORAGE_MEMORY_CACHE_ENABLED = True
+        self.context.config.AWS_RESULT_STORAGE_KEY_SHARDS = 16
+        directory = f"/test/purge_{uuid4()}"
+        for filepath in (f"{directory}/a", f"{directory}/b"):
+            self.context.request = Mock(url=filepath)
+            await ResultStorage(self.context).put(self.test_images["default"])
+
+        await ResultStorage(self.context).remove_many([f"{directory}/b"])
+        expect(await ResultStorage(self.context).get()).to_be_null()
+
+        self.context.request = Mock(url=f"{directory}/a")
+        await ResultStorage(self.context).purge(directory)
+        expect(await ResultStorage(self.context).get()).to_be_null()
+
     @gen_test
     async def test_can_check_deprecated_last_updated_method(self):
         """
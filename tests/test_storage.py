@@ -8,6 +8,8 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
+import asyncio
+from unittest.mock import Mock, call
 from uuid import uuid4
 
 import pytest
@@ -16,8 +18,9 @@ from thumbor.config import Config
 from tornado.testing import gen_test
 
 from tests import BaseS3TestCase
+from thumbor_aws.s3_client import S3Client
 from thumbor_aws.storage import Storage
-from thumbor_aws.utils import normalize_path
+from thumbor_aws.utils import get_shard, normalize_path
 
 
 @pytest.mark.usefixtures("test_images")
@@ -110,6 +113,34 @@ class StorageTestCase(BaseS3TestCase):
 
         expect(data).to_equal(expected)
 
+    @gen_test
+    async def test_get_data_returns_object_metadata(self):
+        """
+        Verifies that get_data returns the object's metadata
+        along with its data
+        """
+        await self.ensure_bucket()
+        storage = Storage(self.context)
+        filepath = f"/test/can_load_file_{uuid4()}"
+        normalized_path = normalize_path(self.context, storage.root_path, filepath)
+        expected = self.test_images["default"]
+        await storage.upload(
+            normalized_path,
+            expected,
+            "image/jpeg",
+            "",
+            metadata={"some": "data"},
+        )
+
+        data = await storage.get_data(self.bucket_name, normalized_path)
+
+        expect(data.status_code).to_equal(200)
+        expect(data.body).to_equal(expected)
+        expect(data.content_type).to_equal("image/jpeg")
+        expect(data.content_length).to_equal(len(expected))
+        expect(data.etag).not_to_be_null()
+        expect(data.metadata).to_equal({"some": "data"})
+
     @gen_test
     async def test_can_handle_expired_data(self):
         """
@@ -131,6 +162,168 @@ class StorageTestCase(BaseS3TestCase):
         expect(status).to_equal(410)
         expect(data).to_equal(b"")
 
+    @gen_test
+    async def test_coalesces_concurrent_reads(self):
+        """
+        Verifies that concurrent reads of the same object
+        share a single request to S3
+        """
+        await self.ensure_bucket()
+        storage = Storage(self.context)
+        filepath = f"/test/can_load_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await storage.put(filepath, expected)
+        coalesced = S3Client.coalesced_reads
+
+        results = await asyncio.gather(
+            *(Storage(self.context).get(filepath) for _ in range(5))
+        )
+
+        expect(results).to_equal([expected] * 5)
+        expect(S3Client.coalesced_reads - coalesced).to_equal(4)
+
+    @gen_test
+    async def test_can_upload_large_file_in_parts(self):
+        """
+        Verifies that objects above the multipart threshold
+        are uploaded in parts and can be read back
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_MULTIPART_UPLOAD_THRESHOLD = 6 * 1024 * 1024
+        self.context.config.AWS_MULTIPART_UPLOAD_PART_SIZE = 5 * 1024 * 1024
+        storage = Storage(self.context)
+        filepath = f"/test/can_upload_in_parts_{uuid4()}"
+        expected = bytes(range(256)) * (12 * 4096)
+
+        await storage.put(filepath, expected)
+
+        metadata = await storage.get_object_metadata(
+            normalize_path(self.context, storage.root_path, filepath)
+        )
+        expect(metadata["ETag"]).to_include("-3")
+        data = await storage.get(filepath)
+        expect(data).to_equal(expected)
+
+    @gen_test
+    async def test_can_get_image_read_in_chunks(self):
+        """
+        Verifies that images read in many chunks
+        come back whole and as bytes
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_BODY_READ_CHUNK_SIZE = 1000
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await storage.put(filepath, expected)
+
+        data = await storage.get(filepath)
+
+        expect(data).to_be_instance_of(bytes)
+        expect(data).to_equal(expected)
+
+    @gen_test
+    async def test_records_metrics_for_s3_operations(self):
+        """
+        Verifies that S3 operations report latency, status
+        and bytes through thumbor's metrics
+        """
+        await self.ensure_bucket()
+        self.context.metrics = Mock()
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        prefix = f"s3.storage.put_object.{storage.bucket_name}"
+
+        await storage.put(filepath, expected)
+        await storage.get(f"/test/missing_{uuid4()}")
+
+        self.context.metrics.incr.assert_has_calls(
+            [
+                call(f"{prefix}.status.200", 1),
+                call(f"{prefix}.bytes", len(expected)),
+            ]
+        )
+        self.context.metrics.incr.assert_any_call(
+            f"s3.storage.get_object.{storage.bucket_name}.status.404", 1
+        )
+        metric, latency = self.context.metrics.timing.call_args_list[0][0]
+        expect(metric).to_equal(f"{prefix}.latency")
+        expect(latency).to_be_greater_than(0)
+
+    @gen_test
+    async def test_records_queue_wait_of_limited_requests(self):
+        """
+        Verifies that the time S3 requests wait for room
+        is recorded when they are limited
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_STORAGE_MAX_CONCURRENT_REQUESTS = 1
+        self.context.metrics = Mock()
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+
+        await asyncio.gather(
+            storage.put(filepath, self.test_images["default"]),
+            storage.exists(filepath),
+        )
+
+        metrics = [args[0] for args, _ in self.context.metrics.timing.call_args_list]
+        expect(metrics).to_include("s3.storage.write.queue_wait")
+        expect(metrics).to_include("s3.storage.read.queue_wait")
+        expect(storage.limiter.active).to_equal(0)
+
+    @gen_test
+    async def test_limited_reads_hold_room_until_body_is_read(self):
+        """
+        Verifies that limited reads keep their room until their body
+        was downloaded, not just until S3 responded
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_STORAGE_MAX_CONCURRENT_REQUESTS = 1
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        await storage.put(filepath, self.test_images["default"])
+        active = []
+        get_body = storage.get_body
+
+        async def recording_get_body(response):
+            active.append(storage.limiter.active)
+            return await get_body(response)
+
+        storage.get_body = recording_get_body
+        data = await storage.get(filepath)
+
+        expect(data).to_equal(self.test_images["default"])
+        expect(active).to_equal([1])
+        expect(storage.limiter.active).to_equal(0)
+
+    @gen_test
+    async def test_remembers_missing_keys_until_written(self):
+        """
+        Verifies that keys found missing are not requested again
+        until they are written through S3Client
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_NEGATIVE_CACHE_TTL = 60
+        storage = Storage(self.context)
+        filepath = f"/test/missing_{uuid4()}"
+        expect(await storage.exists(filepath)).to_be_false()
+
+        async with storage.get_client() as client:
+            await client.put_object(
+                Bucket=storage.bucket_name,
+                Key=normalize_path(self.context, storage.root_path, filepath),
+                Body=b"data",
+            )
+
+        expect(await storage.exists(filepath)).to_be_false()
+        expect(await storage.get(filepath)).to_be_null()
+
+        await storage.put(filepath, b"data")
+
+        expect(await storage.exists(filepath)).to_be_true()
+
     @gen_test
     async def test_upload_with_none_content_type_uses_octet_stream(self):
         """
@@ -198,6 +391,188 @@ class StorageTestCase(BaseS3TestCase):
             }
         )
 
+    @gen_test
+    async def test_can_keep_sidecars_in_metadata(self):
+        """
+        Verifies that crypto and detector data can be kept in
+        the image's metadata instead of in separate objects
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_STORAGE_SIDECARS_IN_METADATA = True
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        normalized_path = normalize_path(self.context, storage.root_path, filepath)
+        expected = self.test_images["default"]
+
+        await storage.put(filepath, expected)
+        await storage.put_crypto(filepath)
+        path = await storage.put_detector_data(filepath, {"some": "data"})
+
+        expect(path).to_equal(
+            f"https://{self.bucket_name}.s3.localhost.localstack.cloud:4566"
+            f"{self._prefix}{filepath}",
+        )
+        expect(await storage.object_exists(f"{normalized_path}.txt")).to_be_false()
+        expect(
+            await storage.object_exists(f"{normalized_path}.detectors.txt")
+        ).to_be_false()
+        storage = Storage(self.context)
+        expect(await storage.get_crypto(filepath)).to_equal("ACME-SEC")
+        expect(await storage.get_detector_data(filepath)).to_be_like(
+            {"some": "data"}
+        )
+        expect(await storage.get(filepath)).to_equal(expected)
+
+    @gen_test
+    async def test_reads_legacy_sidecars_when_kept_in_metadata(self):
+        """
+        Verifies that separate crypto and detector objects are
+        still read when sidecars are kept in metadata
+        """
+        await self.ensure_bucket()
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        await storage.put(filepath, self.test_images["default"])
+        await storage.put_crypto(filepath)
+        await storage.put_detector_data(filepath, {"some": "data"})
+
+        self.context.config.AWS_STORAGE_SIDECARS_IN_METADATA = True
+        storage = Storage(self.context)
+
+        expect(await storage.get_crypto(filepath)).to_equal("ACME-SEC")
+        expect(await storage.get_detector_data(filepath)).to_be_like(
+            {"some": "data"}
+        )
+
+    @gen_test
+    async def test_can_shard_keys(self):
+        """
+        Verifies that with sharding enabled keys get a
+        hash-derived segment after the root path
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_STORAGE_KEY_SHARDS = 256
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        shard = get_shard(filepath.lstrip("/"), 256)
+
+        path = await storage.put(filepath, expected)
+
+        expect(shard).to_length(2)
+        expect(path).to_equal(
+            f"https://{self.bucket_name}.s3.localhost.localstack.cloud:4566"
+            f"{self._prefix}/{shard}{filepath}",
+        )
+        expect(await storage.get(filepath)).to_equal(expected)
+
+    @gen_test
+    async def test_reads_unsharded_keys_when_sharding(self):
+        """
+        Verifies that objects stored before sharding was
+        enabled are still found and removed
+        """
+        await self.ensure_bucket()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await Storage(self.context).put(filepath, expected)
+        await Storage(self.context).put_crypto(filepath)
+
+        self.context.config.AWS_STORAGE_KEY_SHARDS = 16
+        storage = Storage(self.context)
+
+        expect(await storage.get(filepath)).to_equal(expected)
+        expect(await storage.get_crypto(filepath)).to_equal("ACME-SEC")
+        expect(await storage.exists(filepath)).to_be_true()
+        await storage.remove(filepath)
+        expect(await storage.exists(filepath)).to_be_false()
+
+    @gen_test
+    async def test_skips_uploads_of_existing_objects(self):
+        """
+        Verifies that with conditional uploads objects that already
+        exist are not uploaded again
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_SKIP_EXISTING_UPLOADS = True
+        self.context.metrics = Mock()
+        filepath = f"/test/can_put_file_{uuid4()}"
+        expected = self.test_images["default"]
+        await Storage(self.context).put(filepath, expected)
+        prefix = f"s3.storage.put_object.{self.bucket_name}"
+
+        await Storage(self.context).put(filepath, expected)
+        self.context.config.AWS_RECENTLY_WRITTEN_TTL = 0
+        path = await Storage(self.context).put(filepath, b"other data")
+
+        expect(path).to_equal(
+            f"https://{self.bucket_name}.s3.localhost.localstack.cloud:4566"
+            f"{self._prefix}{filepath}",
+        )
+        calls = self.context.metrics.incr.call_args_list
+        expect(calls.count(call("s3.storage.upload.skipped"))).to_equal(2)
+        expect(calls.count(call(f"{prefix}.status.412", 1))).to_equal(1)
+        expect(await Storage(self.context).get(filepath)).to_equal(expected)
+
+    @gen_test
+    async def test_replaces_existing_objects_with_different_hash(self):
+        """
+        Verifies that conditional uploads comparing content hashes
+        replace existing objects with different data
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_SKIP_EXISTING_UPLOADS = True
+        self.context.config.AWS_SKIP_EXISTING_UPLOADS_COMPARE_HASH = True
+        filepath = f"/test/can_put_file_{uuid4()}"
+        await Storage(self.context).put(filepath, self.test_images["default"])
+
+        await Storage(self.context).put(filepath, b"other data")
+
+        expect(await Storage(self.context).get(filepath)).to_equal(
+            b"other data"
+        )
+
+    @gen_test
+    async def test_removes_crypto_and_detector_data_with_image(self):
+        """
+        Verifies that removing an image also removes
+        its crypto and detector data objects
+        """
+        await self.ensure_bucket()
+        storage = Storage(self.context)
+        filepath = f"/test/can_put_file_{uuid4()}"
+        normalized_path = normalize_path(self.context, storage.root_path, filepath)
+        await storage.put(filepath, self.test_images["default"])
+        await storage.put_crypto(filepath)
+        await storage.put_detector_data(filepath, {"some": "data"})
+
+        await storage.remove(filepath)
+
+        for suffix in ("", ".txt", ".detectors.txt"):
+            expect(
+                await storage.object_exists(f"{normalized_path}{suffix}")
+            ).to_be_false()
+
+    @gen_test
+    async def test_can_purge_prefix(self):
+        """
+        Verifies that every image under a path
+        prefix can be removed at once
+        """
+        await self.ensure_bucket()
+        self.context.config.AWS_STORAGE_KEY_SHARDS = 16
+        storage = Storage(self.context)
+        directory = f"/test/purge_{uuid4()}"
+        for name in ("a", "b", "c"):
+            await storage.put(f"{directory}/{name}", b"some data")
+        await storage.put(f"{directory}-other/a", b"some data")
+
+        deleted = await storage.purge(f"{directory}/")
+
+        expect(deleted).to_equal(3)
+        expect(await storage.exists(f"{directory}/a")).to_be_false()
+        expect(await storage.exists(f"{directory}-other/a")).to_be_true()
+
     @gen_test
     async def test_verify_file_does_not_exist(self):
         """Verifies that Storage can tell if a file does not exist in S3"""
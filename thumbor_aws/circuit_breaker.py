@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable
+
+from thumbor.utils import logger
+
+_breakers: Dict[Hashable, "CircuitBreaker"] = {}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Outcomes of the most recent calls the failure rate is computed over
+WINDOW = 100
+
+# Time in seconds between probe requests let through while half open
+PROBE_INTERVAL = 1.0
+
+# Successful probe calls needed to close the breaker again
+PROBES_TO_CLOSE = 3
+
+
+class CircuitBreaker:
+    """
+    Tracks whether S3 is healthy enough to be called.
+
+    It opens when at least threshold of the recent calls, and no less
+    than min_calls of them, failed or took slow_call seconds or more.
+    While open, callers should skip S3. After open_time seconds it lets
+    a probe request through every PROBE_INTERVAL seconds, closing again
+    after PROBES_TO_CLOSE successful calls or opening on the first
+    failed one.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: float,
+        min_calls: int,
+        slow_call: float,
+        open_time: float,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.open_time = open_time
+        self.outcomes: Deque[bool] = deque()
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_probe = 0.0
+        self.probes = 0
+        self._state = CLOSED
+
+    @property
+    def state(self) -> str:
+        """closed, open or half_open"""
+        if (
+            self._state == OPEN
+            and time.monotonic() - self.opened_at >= self.open_time
+        ):
+            self._state = HALF_OPEN
+            self.probes = 0
+            self.last_probe = 0.0
+            logger.info("[CIRCUIT_BREAKER] %s half open", self.name)
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a request may call S3"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+
+        now = time.monotonic()
+        if now - self.last_probe < PROBE_INTERVAL:
+            return False
+        self.last_probe = now
+        return True
+
+    def record(self, failed: bool):
+        """Records the outcome of a call to S3"""
+        state = self.state
+        if state == HALF_OPEN:
+            if failed:
+                self._open()
+                return
+            self.probes += 1
+            if self.probes >= PROBES_TO_CLOSE:
+                self._close()
+            return
+
+        if state == OPEN:
+            # Calls sent before the breaker opened
+            return
+
+        self.outcomes.append(failed)
+        self.failures += failed
+        if len(self.outcomes) > WINDOW:
+            self.failures -= self.outcomes.popleft()
+
+        if (
+            len(self.outcomes) >= self.min_calls
+            and self.failures >= self.threshold * len(self.outcomes)
+        ):
+            self._open()
+
+    def is_failure(self, status: object, seconds: float) -> bool:
+        """
+        Whether a call with status that took seconds counts as failed,
+        as do calls cut short by the request's deadline (timeout)
+        """
+        if status in ("error", "timeout") or seconds >= self.slow_call:
+            return True
+        return isinstance(status, int) and status >= 500
+
+    def _open(self):
+        logger.warning("[CIRCUIT_BREAKER] %s open", self.name)
+        self._state = OPEN
+        self.opened_at = time.monotonic()
+        self._reset()
+
+    def _close(self):
+        logger.info("[CIRCUIT_BREAKER] %s closed", self.name)
+        self._state = CLOSED
+        self._reset()
+
+    def _reset(self):
+        self.outcomes.clear()
+        self.failures = 0
+
+
+def get_circuit_breaker(
+    name: str,
+    threshold: float,
+    min_calls: int,
+    slow_call: float,
+    open_time: float,
+) -> CircuitBreaker:
+    """Gets the process-wide circuit breaker with the given name and settings"""
+    key = (name, threshold, min_calls, slow_call, open_time)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = _breakers[key] = CircuitBreaker(
+            name, threshold, min_calls, slow_call, open_time
+        )
+    return breaker
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+"""
+Removes images stored by thumbor-aws in bulk, e.g. for takedowns.
+
+    thumbor-aws-remove -c thumbor.conf path/to/image.jpg ...
+    thumbor-aws-remove -c thumbor.conf --prefix path/to/
+    thumbor-aws-remove -c thumbor.conf --result-storage --prefix path/to/
+
+Paths are the ones thumbor stores images under: image URLs for storage
+and request URLs for result storage.
+"""
+
+import argparse
+import asyncio
+import sys
+from typing import List, Optional
+
+from thumbor.context import Context
+from thumbor.server import get_config
+
+from thumbor_aws.client_pool import close_clients
+from thumbor_aws.result_storage import Storage as ResultStorage
+from thumbor_aws.storage import Storage
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-c", "--conf", default=None, help="Path to thumbor's configuration"
+    )
+    parser.add_argument(
+        "--result-storage",
+        action="store_true",
+        help="Remove results instead of stored originals",
+    )
+    parser.add_argument(
+        "--prefix",
+        action="store_true",
+        help="Remove everything under each path instead of single images",
+    )
+    parser.add_argument("paths", nargs="+", help="Paths to remove")
+    return parser
+
+
+async def remove(storage, paths: List[str], prefix: bool) -> int:
+    """
+    Removes paths from storage. Returns the number of keys deleted under
+    prefixes, or else the number of keys requested, which may not exist.
+    """
+    try:
+        if not prefix:
+            return await storage.remove_many(paths)
+
+        deleted = await asyncio.gather(*(storage.purge(path) for path in paths))
+        return sum(deleted)
+    finally:
+        await close_clients()
+
+
+def main(arguments: Optional[List[str]] = None) -> int:
+    args = get_parser().parse_args(arguments)
+    context = Context(config=get_config(args.conf))
+    storage_class = ResultStorage if args.result_storage else Storage
+    storage = storage_class(context)
+
+    try:
+        deleted = asyncio.run(remove(storage, args.paths, args.prefix))
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    if args.prefix:
+        print(f"Removed {deleted} objects from {storage.bucket_name}")
+    else:
+        # S3 does not tell which of the requested keys existed
+        print(f"Removed up to {deleted} objects from {storage.bucket_name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import asyncio
+import atexit
+from contextlib import AsyncExitStack
+from typing import Any, Dict, Hashable, Mapping
+
+from aiobotocore.client import AioBaseClient
+from aiobotocore.config import AioConfig
+from aiobotocore.session import AioSession
+from thumbor.utils import logger
+
+_pools: Dict[asyncio.AbstractEventLoop, "ClientPool"] = {}
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, Mapping):
+        return tuple(sorted((key, _freeze(val)) for key, val in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(val) for val in value)
+    return value
+
+
+class ClientPool:
+    """
+    Long-lived S3 clients bound to a single event loop.
+
+    Clients are keyed by region, endpoint, credentials and botocore
+    options, opened lazily on first use and kept open until the pool
+    is closed, so connections are reused between requests.
+    """
+
+    def __init__(self):
+        self.clients: Dict[Hashable, AioBaseClient] = {}
+        self.stack = AsyncExitStack()
+        self.lock = asyncio.Lock()
+
+    async def get(
+        self,
+        session: AioSession,
+        client_args: Mapping[str, Any],
+        options: Mapping[str, Any],
+    ) -> AioBaseClient:
+        """Gets the shared client for the given arguments, opening it if needed"""
+        key = (_freeze(client_args), _freeze(options))
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+
+        async with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                logger.debug(
+                    "[S3_CLIENT] opening client for %s",
+                    client_args.get("endpoint_url")
+                    or client_args.get("region_name"),
+                )
+                client = await self.stack.enter_async_context(
+                    session.create_client(
+                        "s3", config=AioConfig(**options), **client_args
+                    )
+                )
+                self.clients[key] = client
+
+        return client
+
+    async def close(self):
+        """Closes every client opened by this pool"""
+        self.clients.clear()
+        await self.stack.aclose()
+
+
+class PooledClient:
+    """
+    Async context manager yielding a shared client from the pool of the
+    running loop. Unlike aiobotocore's own context, leaving it does not
+    close the client.
+    """
+
+    def __init__(
+        self,
+        session: AioSession,
+        client_args: Mapping[str, Any],
+        options: Mapping[str, Any],
+    ):
+        self.session = session
+        self.client_args = client_args
+        self.options = options
+
+    async def __aenter__(self) -> AioBaseClient:
+        return await get_pool().get(
+            self.session, self.client_args, self.options
+        )
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def get_pool() -> ClientPool:
+    """Gets the client pool for the running event loop"""
+    loop = asyncio.get_running_loop()
+
+    for stale in [item for item in _pools if item.is_closed()]:
+        del _pools[stale]
+
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = ClientPool()
+    return pool
+
+
+async def close_clients():
+    """Closes all pooled clients bound to the running event loop"""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
+
+
+def _close_at_exit():
+    # thumbor stops (but does not close) its IOLoop before exiting,
+    # so the loop can still drive the clients' shutdown.
+    for loop, pool in list(_pools.items()):
+        if loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(pool.close())
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("[S3_CLIENT] failed to close clients: %s", error)
+    _pools.clear()
+
+
+atexit.register(_close_at_exit)
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Tuple
+
+_limiters: Dict[
+    Tuple[asyncio.AbstractEventLoop, str, int, int], "ConcurrencyLimiter"
+] = {}
+
+
+class ConcurrencyLimiter:
+    """
+    Bounds the number of S3 requests in flight, giving reads priority
+    over writes.
+
+    At most limit requests run at once, of which at most write_limit
+    are writes. A limit of 0 leaves that bound out. Whenever a request
+    finishes, waiting reads start before any waiting write, so a burst
+    of uploads can't keep reads queued behind it.
+    """
+
+    def __init__(self, limit: int, write_limit: int):
+        self.limit = limit
+        self.write_limit = write_limit
+        self.active = 0
+        self.active_writes = 0
+        self.reads: Deque[asyncio.Future] = deque()
+        self.writes: Deque[asyncio.Future] = deque()
+
+    @asynccontextmanager
+    async def slot(self, write: bool) -> AsyncIterator[None]:
+        """Waits for room for a request and holds it until leaving"""
+        await self.acquire(write)
+        try:
+            yield
+        finally:
+            self.release(write)
+
+    async def acquire(self, write: bool):
+        """Waits until a read or write may start"""
+        waiters = self.writes if write else self.reads
+        ahead = (self.reads or self.writes) if write else self.reads
+        if not ahead and self._has_room(write):
+            self._start(write)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Room was made for this request right before it was cancelled
+                self.release(write)
+            else:
+                waiters.remove(waiter)
+            raise
+
+    def release(self, write: bool):
+        """Makes room for the next waiting request"""
+        self.active -= 1
+        if write:
+            self.active_writes -= 1
+        self._wake(self.reads, False)
+        self._wake(self.writes, True)
+
+    def _has_room(self, write: bool) -> bool:
+        if self.limit and self.active >= self.limit:
+            return False
+        return not (
+            write and self.write_limit and self.active_writes >= self.write_limit
+        )
+
+    def _start(self, write: bool):
+        self.active += 1
+        if write:
+            self.active_writes += 1
+
+    def _wake(self, waiters: Deque[asyncio.Future], write: bool):
+        while waiters and self._has_room(write):
+            waiter = waiters.popleft()
+            if not waiter.done():
+                self._start(write)
+                waiter.set_result(None)
+
+
+def get_limiter(
+    name: str, limit: int, write_limit: int
+) -> ConcurrencyLimiter:
+    """Gets the limiter called name of the running event loop"""
+    loop = asyncio.get_running_loop()
+
+    for stale in [key for key in _limiters if key[0].is_closed()]:
+        del _limiters[stale]
+
+    key = (loop, name, limit, write_limit)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters[key] = ConcurrencyLimiter(limit, write_limit)
+    return limiter
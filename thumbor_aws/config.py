@@ -22,6 +22,122 @@ Config.define(
     "AWS Storage",
 )
 
+Config.define(
+    "AWS_MULTIPART_UPLOAD_THRESHOLD",
+    16 * 1024 * 1024,
+    "Objects of at least this many bytes are uploaded to S3 using "
+    "multipart upload. Set to 0 to always use a single request.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_MULTIPART_UPLOAD_PART_SIZE",
+    8 * 1024 * 1024,
+    "Size in bytes of each part of a multipart upload. "
+    "S3 requires at least 5MB.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_MULTIPART_UPLOAD_CONCURRENCY",
+    4,
+    "Maximum number of parts of a multipart upload sent concurrently.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_BODY_READ_CHUNK_SIZE",
+    64 * 1024,
+    "Size in bytes of the chunks objects are read from S3 in, straight "
+    "into a buffer of the object's size. Set to 0 to read in as few "
+    "chunks as possible.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_NEGATIVE_CACHE_TTL",
+    0,
+    "Time in seconds that keys found missing in S3 are remembered as "
+    "missing, saving requests for them. Keys written by this process are "
+    "forgotten immediately. Defaults to 0 (disabled).",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_NEGATIVE_CACHE_MAX_ENTRIES",
+    10000,
+    "Maximum number of missing keys remembered.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_SKIP_EXISTING_UPLOADS",
+    False,
+    "Stores originals and results with conditional uploads "
+    "(If-None-Match: *), so storing an object that already exists and has "
+    "not expired costs a 412 response instead of replacing it.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_SKIP_EXISTING_UPLOADS_COMPARE_HASH",
+    False,
+    "Also keeps a SHA-256 of uploaded data in the object's metadata and "
+    "only skips uploads of identical data.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_RECENTLY_WRITTEN_TTL",
+    60,
+    "Time in seconds keys uploaded by this process are remembered when "
+    "AWS_SKIP_EXISTING_UPLOADS is enabled, so that uploading them again is "
+    "skipped without calling S3. Set to 0 to disable.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_RECENTLY_WRITTEN_MAX_ENTRIES",
+    10000,
+    "Maximum number of recently uploaded keys remembered.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_DELETE_CONCURRENCY",
+    4,
+    "Maximum number of DeleteObjects requests, of up to 1000 keys each, "
+    "in flight when removing many objects at once.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_OPTIONAL_DEADLINE",
+    0,
+    "Time in seconds from the start of a request after which storage and "
+    "result storage stop waiting for S3, treating reads as misses and "
+    "skipping writes. Defaults to 0 (no deadline).",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_MANDATORY_DEADLINE",
+    0,
+    "Time in seconds from the start of a request after which the loader "
+    "stops waiting for S3, failing the request with a timeout. Defaults "
+    "to 0 (no deadline).",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_KEY_SHARDS_READ_FALLBACK",
+    True,
+    "When keys are sharded, also looks for objects missing from the "
+    "sharded layout under their unsharded key, so that objects stored "
+    "before sharding was enabled are still found.",
+    "AWS Storage",
+)
+
 # TC_AWS Compatibility settings
 Config.define(
     "THUMBOR_AWS_RUN_IN_COMPATIBILITY_MODE",
@@ -37,7 +153,13 @@ Config.define(
     "tc_aws Compatibility",
 )
 
-# TODO: Support retries
+Config.define(
+    "TC_AWS_ENDPOINT",
+    None,
+    "Custom S3 endpoint URL. Defaults to the AWS endpoint of the region.",
+    "tc_aws Compatibility",
+)
+
 Config.define(
     "TC_AWS_MAX_RETRY",
     0,
@@ -133,6 +255,104 @@ Config.define(
 )
 
 
+def define_transport_settings(prefix: str, group: str):
+    """Defines the settings of the connections to S3 for an extension"""
+
+    Config.define(
+        f"{prefix}_MAX_POOL_CONNECTIONS",
+        50,
+        "Maximum number of connections to S3 kept in the pool.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_CONNECT_TIMEOUT",
+        10,
+        "Time in seconds to wait for a connection to S3 to be established.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_READ_TIMEOUT",
+        30,
+        "Time in seconds to wait for S3 to send data on a connection.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_RETRY_MODE",
+        "adaptive",
+        "botocore retry mode to use with S3: legacy, standard or adaptive.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_MAX_ATTEMPTS",
+        3,
+        "Maximum number of retries of a failed S3 request. "
+        "Replaced by TC_AWS_MAX_RETRY in compatibility mode, unless it is 0.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_KEEPALIVE_TIMEOUT",
+        12,
+        "Time in seconds an idle connection to S3 is kept open for reuse.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_MAX_CONCURRENT_REQUESTS",
+        0,
+        "Maximum number of S3 requests in flight, downloads counting until "
+        "their body was read. Reads waiting for room start before writes. "
+        "Defaults to 0 (unlimited).",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_MAX_CONCURRENT_WRITES",
+        0,
+        "Maximum number of S3 writes (uploads, copies and deletes) in "
+        "flight, leaving room for reads. Defaults to 0 (only bound by "
+        f"{prefix}_MAX_CONCURRENT_REQUESTS).",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_HEDGE_DELAY",
+        0,
+        "Time in seconds after which a GET that S3 has not answered yet "
+        "gets a second, identical GET, using whichever responds first. "
+        "Defaults to 0 (disabled).",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_HEDGE_PERCENTILE",
+        0,
+        "Percentile of recent GET latencies (e.g. 95) after which GETs are "
+        f"hedged instead of {prefix}_HEDGE_DELAY, once enough latencies "
+        "were seen. Defaults to 0 (always use the fixed delay).",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_HEDGE_BUDGET",
+        0.05,
+        "Maximum share of GETs that may be hedged, capping the extra "
+        "requests sent to S3.",
+        group,
+    )
+
+    Config.define(
+        f"{prefix}_ADDRESSING_STYLE",
+        "auto",
+        "S3 addressing style: auto, virtual or path.",
+        group,
+    )
+
+
 def __generate_config():
     config.generate_config()
 
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from hashlib import sha256
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, Optional, Tuple
+
+from thumbor.utils import logger
+
+TEMP_PREFIX = ".tmp-"
+
+# Share of the size budget eviction frees room down to, so that the cache
+# directory is only scanned again after a good number of writes
+EVICT_TO = 0.9
+
+_caches: Dict[Tuple[str, int], "DiskCache"] = {}
+
+
+class DiskCache:
+    """
+    Size-bounded cache of S3 objects on local disk.
+
+    Each object is stored in its own file named after a hash of
+    (bucket, key). The file's modification time holds the object's
+    LastModified and its access time is bumped on every hit, so
+    eviction removes the least recently used files first. Files are
+    written atomically, which makes the cache safe to share between
+    thumbor processes on the same node.
+
+    The size of the cache is scanned from disk on the first write and
+    then kept up to date with this process's writes. The directory is
+    only scanned again to evict files once over the size budget, which
+    is also when writes of other processes are accounted for.
+    """
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.size: Optional[int] = None
+        self.lock = threading.Lock()
+
+    def get_file_path(self, bucket: str, key: str) -> str:
+        digest = sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    async def get(
+        self, bucket: str, key: str
+    ) -> Optional[Tuple[bytes, datetime]]:
+        """Gets the cached data and LastModified of an object, if any"""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._read, self.get_file_path(bucket, key)
+        )
+
+    async def put(
+        self, bucket: str, key: str, data: bytes, last_modified: datetime
+    ):
+        """Stores an object, evicting old files if over the size budget"""
+        if len(data) > self.max_size:
+            return
+
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            self._write,
+            self.get_file_path(bucket, key),
+            data,
+            last_modified,
+        )
+
+    def _read(self, file_path: str) -> Optional[Tuple[bytes, datetime]]:
+        try:
+            with open(file_path, "rb") as cached:
+                stat = os.fstat(cached.fileno())
+                data = cached.read()
+            os.utime(file_path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+
+        last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        return data, last_modified
+
+    def _write(self, file_path: str, data: bytes, last_modified: datetime):
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            replaced = os.stat(file_path).st_size
+        except FileNotFoundError:
+            replaced = 0
+
+        with NamedTemporaryFile(
+            dir=directory, prefix=TEMP_PREFIX, delete=False
+        ) as temp:
+            temp.write(data)
+        os.utime(temp.name, (time.time(), last_modified.timestamp()))
+        os.replace(temp.name, file_path)
+
+        with self.lock:
+            if self.size is not None:
+                self.size += len(data) - replaced
+            if self.size is None or self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        files: List[Tuple[float, int, str]] = []
+        total_size = 0
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if name.startswith(TEMP_PREFIX):
+                    continue
+                file_path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime, stat.st_size, file_path))
+                total_size += stat.st_size
+
+        if total_size > self.max_size:
+            for _, size, file_path in sorted(files):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    continue
+                logger.debug("[DISK_CACHE] evicted %s", file_path)
+                total_size -= size
+                if total_size <= self.max_size * EVICT_TO:
+                    break
+
+        self.size = total_size
+
+
+def get_disk_cache(path: str, max_size: int) -> DiskCache:
+    """Gets the process-wide disk cache kept in path"""
+    key = (path, max_size)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = DiskCache(path, max_size)
+    return cache
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional
+
+_policies: Dict[Hashable, "HedgingPolicy"] = {}
+
+# Latencies kept to compute the hedging percentile from
+LATENCY_WINDOW = 1000
+
+# Latencies needed before the percentile is used instead of the fixed delay
+MIN_SAMPLES = 100
+
+# The percentile is computed again after this many new latencies
+RECOMPUTE_EVERY = 50
+
+# Hedges that can be saved up while S3 is fast, to spend on a slow burst
+MAX_TOKENS = 10.0
+
+
+class HedgingPolicy:
+    """
+    Decides when a GET still waiting for S3 gets a second, identical GET.
+
+    The hedge is sent after delay seconds or, once enough latencies were
+    recorded, after the given percentile of recent latencies. Each GET
+    adds budget to a token bucket and each hedge takes a whole token, so
+    at most a budget share of GETs is hedged.
+    """
+
+    def __init__(self, delay: float, percentile: float, budget: float):
+        self.delay = delay
+        self.percentile = percentile
+        self.budget = budget
+        self.tokens = MAX_TOKENS
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.recorded = 0
+        self.percentile_delay: Optional[float] = None
+
+    def get_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a GET, None if it shouldn't be"""
+        if self.percentile and self.percentile_delay is not None:
+            return self.percentile_delay
+        return self.delay or None
+
+    def start(self):
+        """Records that a GET was sent, adding to the hedging budget"""
+        self.tokens = min(self.tokens + self.budget, MAX_TOKENS)
+
+    def try_hedge(self) -> bool:
+        """Takes a hedge from the budget, returning False if none is left"""
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def record(self, seconds: float):
+        """Records the latency of a GET"""
+        self.latencies.append(seconds)
+        self.recorded += 1
+        if (
+            self.percentile
+            and len(self.latencies) >= MIN_SAMPLES
+            and (
+                self.percentile_delay is None
+                or self.recorded % RECOMPUTE_EVERY == 0
+            )
+        ):
+            latencies = sorted(self.latencies)
+            index = int(len(latencies) * self.percentile / 100)
+            self.percentile_delay = latencies[min(index, len(latencies) - 1)]
+
+
+def get_hedging_policy(
+    name: str, delay: float, percentile: float, budget: float
+) -> HedgingPolicy:
+    """Gets the process-wide hedging policy with the given name and settings"""
+    key = (name, delay, percentile, budget)
+    policy = _policies.get(key)
+    if policy is None:
+        policy = _policies[key] = HedgingPolicy(delay, percentile, budget)
+    return policy
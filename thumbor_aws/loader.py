@@ -9,9 +9,16 @@
 # Copyright (c) 2011 globo.com thumbor@googlegroups.com
 
 
+import os
+from datetime import datetime
+from tempfile import gettempdir
+from typing import Optional
+
 from thumbor.loaders import LoaderResult
 
-from thumbor_aws.config import Config
+import thumbor_aws.disk_cache
+from thumbor_aws.config import Config, define_transport_settings
+from thumbor_aws.disk_cache import DiskCache
 from thumbor_aws.s3_client import S3Client
 from thumbor_aws.utils import normalize_path
 
@@ -57,10 +64,52 @@ Config.define(
     "AWS Loader",
 )
 
+define_transport_settings("AWS_LOADER", "AWS Loader")
 
-async def load(context, path):
-    """Loader to get source files from S3"""
+Config.define(
+    "AWS_LOADER_RANGED_GET_PART_SIZE",
+    0,
+    "When greater than 0, source images bigger than this many bytes are "
+    "downloaded as concurrent ranged GETs of this size. "
+    "Defaults to 0 (a single GET per image).",
+    "AWS Loader",
+)
+
+Config.define(
+    "AWS_LOADER_RANGED_GET_CONCURRENCY",
+    4,
+    "Maximum number of ranged GETs in flight for a single source image.",
+    "AWS Loader",
+)
+
+Config.define(
+    "AWS_LOADER_DISK_CACHE_ENABLED",
+    False,
+    "Keeps source images loaded from S3 in a cache on local disk. Cached "
+    "images are revalidated against S3 with a conditional HEAD request.",
+    "AWS Loader",
+)
+
+Config.define(
+    "AWS_LOADER_DISK_CACHE_PATH",
+    os.path.join(gettempdir(), "thumbor-aws-loader"),
+    "Directory where the loader disk cache is kept.",
+    "AWS Loader",
+)
+
+Config.define(
+    "AWS_LOADER_DISK_CACHE_MAX_SIZE",
+    1024 * 1024 * 1024,
+    "Maximum size in bytes of the loader disk cache. Once over it, least "
+    "recently used images are evicted until it is 90% full.",
+    "AWS Loader",
+)
+
+
+def get_s3_client(context) -> S3Client:
+    """S3Client configured with the loader settings"""
     client = S3Client(context)
+    client.subsystem = "loader"
     client.configuration = {
         "region_name": context.config.AWS_LOADER_REGION_NAME,
         "secret_access_key": context.config.AWS_LOADER_S3_SECRET_ACCESS_KEY,
@@ -78,6 +127,12 @@ async def load(context, path):
         client.configuration[
             "root_path"
         ] = context.config.TC_AWS_LOADER_ROOT_PATH
+    return client
+
+
+async def load(context, path):
+    """Loader to get source files from S3"""
+    client = get_s3_client(context)
 
     bucket, real_path = get_bucket_and_path(
         client.configuration["bucket_name"], path
@@ -86,15 +141,38 @@ async def load(context, path):
     norm_path = normalize_path(context, client.configuration["root_path"], real_path)
     result = LoaderResult()
 
-    status_code, body, last_modified = await client.get_data(
-        bucket, norm_path, expiration=None
-    )
-
-    if status_code != 200:
-        result.error = LoaderResult.ERROR_NOT_FOUND
-        result.extra = body
-        result.successful = False
-        return result
+    disk_cache = get_disk_cache(context)
+    cached = None
+    if disk_cache is not None:
+        cached = await disk_cache.get(bucket, norm_path)
+
+    # A cached copy that can't be revalidated in time is still served
+    if cached is not None and not await client.is_modified_since(
+        bucket, norm_path, cached[1], modified_on_timeout=False
+    ):
+        context.metrics.incr("loader.disk_cache.hit")
+        body, last_modified = cached
+    else:
+        status_code, body, last_modified = await client.get_data(
+            bucket,
+            norm_path,
+            expiration=None,
+            range_size=context.config.AWS_LOADER_RANGED_GET_PART_SIZE,
+        )
+
+        if status_code != 200:
+            result.error = (
+                LoaderResult.ERROR_TIMEOUT
+                if status_code == 504
+                else LoaderResult.ERROR_NOT_FOUND
+            )
+            result.extra = body
+            result.successful = False
+            return result
+
+        if disk_cache is not None:
+            context.metrics.incr("loader.disk_cache.miss")
+            await disk_cache.put(bucket, norm_path, body, last_modified)
 
     result.successful = True
     result.buffer = body
@@ -103,10 +181,38 @@ async def load(context, path):
         size=len(body),
         updated_at=last_modified,
     )
+    # Lets result storage record which source a result was generated from
+    context.aws_loaded_source = {
+        "bucket": bucket,
+        "key": norm_path,
+        "last_modified": last_modified,
+    }
 
     return result
 
 
+def get_disk_cache(context) -> Optional[DiskCache]:
+    """Disk cache for source images, if enabled"""
+    if not context.config.AWS_LOADER_DISK_CACHE_ENABLED:
+        return None
+
+    return thumbor_aws.disk_cache.get_disk_cache(
+        context.config.AWS_LOADER_DISK_CACHE_PATH,
+        context.config.AWS_LOADER_DISK_CACHE_MAX_SIZE,
+    )
+
+
+async def is_modified_since(
+    context, bucket: str, path: str, last_modified: datetime
+) -> bool:
+    """
+    Revalidates a source image previously loaded from S3, telling
+    whether it changed (or is gone) since last_modified.
+    """
+    client = get_s3_client(context)
+    return await client.is_modified_since(bucket, path, last_modified)
+
+
 def get_bucket_and_path(configured_bucket: str, path: str) -> (str, str):
     bucket = configured_bucket
     real_path = path
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_caches: Dict[Tuple[str, int, int], "MemoryCache"] = {}
+
+
+class MemoryCache:
+    """
+    Bounded LRU cache of S3 objects kept in process memory.
+
+    The cache is limited both by the total size of the stored buffers
+    and by the number of entries. Each entry carries its own expiration
+    timestamp and is dropped when read after it.
+    """
+
+    def __init__(self, max_size: int, max_entries: int):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries: "OrderedDict[Hashable, Tuple[bytes, Any, float]]" = (
+            OrderedDict()
+        )
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Any]]:
+        """Gets the buffer and metadata stored for key, if still fresh"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        buffer, metadata, expires_at = entry
+        if time.time() >= expires_at:
+            self.remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return buffer, metadata
+
+    def set(
+        self, key: Hashable, buffer: bytes, metadata: Any, expires_at: float
+    ) -> int:
+        """
+        Stores buffer under key until expires_at (a unix timestamp).
+        Returns how many entries were evicted to make room for it.
+        """
+        if len(buffer) > self.max_size:
+            return 0
+
+        self.remove(key)
+        self.entries[key] = (buffer, metadata, expires_at)
+        self.size += len(buffer)
+
+        evicted = 0
+        while self.size > self.max_size or len(self.entries) > self.max_entries:
+            _, (evicted_buffer, _, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted_buffer)
+            evicted += 1
+
+        self.evictions += evicted
+        return evicted
+
+    def remove(self, key: Hashable):
+        """Removes key from the cache if present"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def remove_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Removes every key predicate is true for, returning how many"""
+        keys = [key for key in self.entries if predicate(key)]
+        for key in keys:
+            self.remove(key)
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def get_memory_cache(name: str, max_size: int, max_entries: int) -> MemoryCache:
+    """Gets the process-wide cache with the given name and limits"""
+    key = (name, max_size, max_entries)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = MemoryCache(max_size, max_entries)
+    return cache
@@ -8,17 +8,26 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
-
+import asyncio
+import hmac
+import time
 from datetime import datetime, timezone
+from hashlib import sha256
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, Optional, Tuple
+from urllib.parse import quote, unquote
 
 from deprecated import deprecated
 from thumbor.engines import BaseEngine
 from thumbor.result_storages import BaseStorage, ResultStorageResult
 from thumbor.utils import logger
+from tornado.httpclient import AsyncHTTPClient
 
-from thumbor_aws.config import Config
-from thumbor_aws.s3_client import S3Client
-from thumbor_aws.utils import normalize_path
+import thumbor_aws.loader
+from thumbor_aws.circuit_breaker import CircuitBreaker, get_circuit_breaker
+from thumbor_aws.config import Config, define_transport_settings
+from thumbor_aws.memory_cache import MemoryCache, get_memory_cache
+from thumbor_aws.s3_client import S3Client, S3Object
+from thumbor_aws.write_behind import get_write_behind_queue
 
 Config.define(
     "AWS_RESULT_STORAGE_REGION_NAME",
@@ -69,8 +78,163 @@ Config.define(
     "AWS Result Storage",
 )
 
+Config.define(
+    "AWS_RESULT_STORAGE_KEY_SHARDS",
+    0,
+    "When greater than 1, result storage keys get a leading segment derived "
+    "from a hash of the key, spreading them over this many prefixes so that "
+    "S3 can serve more requests without throttling. Defaults to 0 "
+    "(unsharded).",
+    "AWS Result Storage",
+)
+
+define_transport_settings("AWS_RESULT_STORAGE", "AWS Result Storage")
+
+Config.define(
+    "AWS_RESULT_STORAGE_MEMORY_CACHE_ENABLED",
+    False,
+    "Keeps recently used results in an in-process LRU cache "
+    "in front of S3.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_MEMORY_CACHE_MAX_SIZE",
+    64 * 1024 * 1024,
+    "Maximum size in bytes of the results kept in the memory cache.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_MEMORY_CACHE_MAX_ENTRIES",
+    1000,
+    "Maximum number of results kept in the memory cache.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_REVALIDATE_EXPIRED",
+    False,
+    "Instead of discarding expired results, checks whether their source "
+    "image changed in the loader bucket and, if it did not, refreshes and "
+    "serves them.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_WRITE_BEHIND_ENABLED",
+    False,
+    "Uploads results to S3 in the background instead of waiting for the "
+    "upload before finishing the request.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_WRITE_BEHIND_QUEUE_SIZE",
+    1000,
+    "Maximum number of results waiting to be uploaded in the background.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_WRITE_BEHIND_WORKERS",
+    4,
+    "Number of concurrent background uploads.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_WRITE_BEHIND_MAX_WAIT",
+    0.1,
+    "Time in seconds a request waits for room in a full background upload "
+    "queue before its result is dropped instead of stored.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_STALE_WHILE_REVALIDATE",
+    0,
+    "Time in seconds results are still served after expiring, while a "
+    "single background request per result has thumbor generate it again. "
+    "Defaults to 0 (expired results are misses).",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_REGENERATE_URL",
+    None,
+    "Base URL of this thumbor server used to generate stale results again. "
+    "Defaults to None (http://127.0.0.1:<port>).",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_REDIRECT_MODE",
+    None,
+    "Instead of downloading results and sending them to clients, redirects "
+    "clients to them: 'presigned' redirects to presigned S3 URLs and "
+    "'public' to URLs built from AWS_DEFAULT_LOCATION. Defaults to None "
+    "(results are served by thumbor).",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_PRESIGNED_URL_EXPIRATION",
+    3600,
+    "Time in seconds presigned URLs of results are valid for. They are "
+    "reused until 90% of this time has passed.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_PRESIGNED_URL_CACHE_MAX_ENTRIES",
+    10000,
+    "Maximum number of presigned URLs of results kept for reuse.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_CIRCUIT_BREAKER_THRESHOLD",
+    0,
+    "Share of recent result storage calls to S3 (e.g. 0.5) that must fail "
+    "or be slow for result storage to stop calling S3 for a while, "
+    "treating reads as misses and skipping writes. Defaults to 0 "
+    "(disabled).",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_CIRCUIT_BREAKER_MIN_CALLS",
+    20,
+    "Minimum number of recent calls to S3 before result storage can stop "
+    "calling it.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_CIRCUIT_BREAKER_SLOW_CALL",
+    2,
+    "Time in seconds after which a result storage call to S3 counts as "
+    "failed for the circuit breaker.",
+    "AWS Result Storage",
+)
+
+Config.define(
+    "AWS_RESULT_STORAGE_CIRCUIT_BREAKER_OPEN_TIME",
+    10,
+    "Time in seconds result storage stops calling S3 for before letting "
+    "probe requests through.",
+    "AWS Result Storage",
+)
+
+REGENERATE_HEADER = "X-Thumbor-Aws-Regenerate"
+REGENERATE_TIMEOUT = 60
+
 
 class Storage(BaseStorage, S3Client):
+    __regenerations: Dict[Hashable, asyncio.Future] = {}
+    subsystem = "result_storage"
+
     def __init__(self, context):
         BaseStorage.__init__(self, context)
         S3Client.__init__(self, context)
@@ -134,21 +298,196 @@ class Storage(BaseStorage, S3Client):
             self.context.config.AWS_RESULT_STORAGE_ROOT_PATH,
         )
 
+    @property
+    def circuit_breaker(self) -> Optional[CircuitBreaker]:
+        """Process-wide circuit breaker of the result storage bucket, if enabled"""
+        threshold = self.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_THRESHOLD
+        if not threshold:
+            return None
+
+        return get_circuit_breaker(
+            f"{self.endpoint_url or self.region_name}/{self.bucket_name}",
+            threshold,
+            self.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_MIN_CALLS,
+            self.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_SLOW_CALL,
+            self.config.AWS_RESULT_STORAGE_CIRCUIT_BREAKER_OPEN_TIME,
+        )
+
+    def _is_s3_available(self) -> bool:
+        """
+        Whether result storage may call S3, reporting the state of
+        the circuit breaker
+        """
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return True
+
+        allowed = breaker.allow()
+        self.context.metrics.incr(
+            f"result_storage.circuit_breaker.{breaker.state}"
+        )
+        if not allowed:
+            self.context.metrics.incr("result_storage.circuit_breaker.skipped")
+        return allowed
+
+    @property
+    def memory_cache(self) -> MemoryCache:
+        """Process-wide memory cache for results, if enabled"""
+        if not self.config.AWS_RESULT_STORAGE_MEMORY_CACHE_ENABLED:
+            return None
+
+        return get_memory_cache(
+            "result_storage",
+            self.config.AWS_RESULT_STORAGE_MEMORY_CACHE_MAX_SIZE,
+            self.config.AWS_RESULT_STORAGE_MEMORY_CACHE_MAX_ENTRIES,
+        )
+
+    def _get_memory_cache_expiration(self, last_modified: datetime) -> float:
+        """
+        Timestamp after which a cached result must not be served anymore:
+        never later than S3 itself would consider it expired.
+        """
+        expires_at = float("inf")
+        if self.config.STORAGE_EXPIRATION_SECONDS is not None:
+            expires_at = (
+                last_modified.timestamp()
+                + self.config.STORAGE_EXPIRATION_SECONDS
+            )
+        if self.config.RESULT_STORAGE_EXPIRATION_SECONDS:
+            expires_at = min(
+                expires_at,
+                last_modified.timestamp()
+                + self.config.RESULT_STORAGE_EXPIRATION_SECONDS,
+            )
+        return expires_at
+
+    def _cache_in_memory(self, key: str, data: S3Object):
+        cache = self.memory_cache
+        if cache is None:
+            return
+
+        evicted = cache.set(
+            (self.bucket_name, key),
+            data.body,
+            data,
+            self._get_memory_cache_expiration(data.last_modified),
+        )
+        if evicted:
+            self.context.metrics.incr(
+                "result_storage.memory_cache.eviction", evicted
+            )
+
     async def put(self, image_bytes: bytes) -> str:
-        file_abspath = normalize_path(self.context, self.prefix, self.context.request.url)
+        file_abspath = self.normalize_key(self.prefix, self.context.request.url)
         logger.debug("[RESULT_STORAGE] putting at %s", file_abspath)
         content_type = BaseEngine.get_mimetype(image_bytes)
+        metadata = self._get_source_metadata()
+
+        if not self._is_s3_available():
+            logger.debug("[RESULT_STORAGE] S3 unavailable, not storing %s", file_abspath)
+            return self.get_location(
+                file_abspath, self.context.config.AWS_DEFAULT_LOCATION
+            )
+
+        if self.config.AWS_RESULT_STORAGE_WRITE_BEHIND_ENABLED:
+            queue = get_write_behind_queue(
+                self.config.AWS_RESULT_STORAGE_WRITE_BEHIND_QUEUE_SIZE,
+                self.config.AWS_RESULT_STORAGE_WRITE_BEHIND_WORKERS,
+            )
+            uploader = self.detach()
+            await queue.put(
+                (self.bucket_name, file_abspath),
+                # Written after the request finished, so not bound by its deadline
+                lambda: uploader._upload(
+                    file_abspath,
+                    image_bytes,
+                    content_type,
+                    self.config.AWS_DEFAULT_LOCATION,
+                    metadata=metadata,
+                    skip_existing=self.config.AWS_SKIP_EXISTING_UPLOADS,
+                ),
+                self.context.metrics,
+                self.config.AWS_RESULT_STORAGE_WRITE_BEHIND_MAX_WAIT,
+            )
+            logger.debug(
+                "[RESULT_STORAGE] Image queued for upload to %s", file_abspath
+            )
+            self._cache_in_memory(
+                file_abspath, self._get_put_data(image_bytes, content_type)
+            )
+            return self.get_location(
+                file_abspath, self.context.config.AWS_DEFAULT_LOCATION
+            )
+
         response = await self.upload(
             file_abspath,
             image_bytes,
             content_type,
             self.context.config.AWS_DEFAULT_LOCATION,
+            metadata=metadata,
+            skip_existing=self.config.AWS_SKIP_EXISTING_UPLOADS,
         )
         logger.info(
             "[RESULT_STORAGE] Image uploaded successfully to %s", file_abspath
         )
+        self._cache_in_memory(
+            file_abspath, self._get_put_data(image_bytes, content_type)
+        )
         return response
 
+    def _get_put_data(self, image_bytes: bytes, content_type: str) -> S3Object:
+        return S3Object(
+            200,
+            image_bytes,
+            datetime.now(timezone.utc),
+            {"ContentType": content_type},
+        )
+
+    def _get_source_metadata(self) -> Optional[Dict[str, str]]:
+        """
+        S3 metadata identifying the source image loaded by
+        thumbor_aws.loader for this request, if any
+        """
+        source = getattr(self.context, "aws_loaded_source", None)
+        if source is None:
+            return None
+
+        return {
+            "source-bucket": source["bucket"],
+            "source-key": quote(source["key"]),
+            "source-last-modified": source["last_modified"].isoformat(),
+        }
+
+    async def _revalidate(self, file_abspath: str) -> S3Object:
+        """
+        Serves an expired result again if the source image it was generated
+        from did not change since, refreshing the result in S3.
+        """
+        response = await self.find_object_metadata(file_abspath)
+        if response is None:
+            # Removed since it was found expired
+            return S3Object(410, b"")
+
+        metadata = response.get("Metadata", {})
+        if "source-key" not in metadata:
+            return S3Object(410, b"")
+
+        modified = await thumbor_aws.loader.is_modified_since(
+            self.context,
+            metadata["source-bucket"],
+            unquote(metadata["source-key"]),
+            datetime.fromisoformat(metadata["source-last-modified"]),
+        )
+        if modified:
+            return S3Object(410, b"")
+
+        logger.debug(
+            "[RESULT_STORAGE] source unchanged, refreshing %s", file_abspath
+        )
+        await self.refresh(file_abspath, response)
+        self.context.metrics.incr("result_storage.revalidated")
+        return await self.get_data(self.bucket_name, file_abspath)
+
     @property
     def is_auto_webp(self) -> bool:
         """
@@ -163,26 +502,133 @@ class Storage(BaseStorage, S3Client):
     def prefix(self) -> str:
         return self.root_path + ("/auto_webp" if self.is_auto_webp else "")
 
+    async def remove_many(self, urls: Iterable[str]) -> int:
+        """
+        Removes the results of thumbor URLs, with and without auto
+        webp, in bulk. Returns the number of keys requested, including
+        the auto webp keys of results that have none.
+        """
+        webp_path = f"{self.root_path}/auto_webp"
+        keys = {
+            key
+            for url in urls
+            for prefix in (self.root_path, webp_path)
+            for key in self.get_keys(prefix, url)
+        }
+        try:
+            return await self.delete_objects(keys)
+        finally:
+            self._remove_from_memory(lambda key: key in keys)
+
+    async def purge(self, url_prefix: str) -> int:
+        """
+        Removes the results of every thumbor URL starting with
+        url_prefix. Returns the number of keys deleted.
+        """
+        webp_path = f"{self.root_path}/auto_webp"
+        try:
+            deleted = await asyncio.gather(
+                self.delete_path_prefix(
+                    self.root_path, url_prefix, excluded=[f"{webp_path}/"]
+                ),
+                self.delete_path_prefix(webp_path, url_prefix),
+            )
+        finally:
+            key_prefixes = (
+                *self.get_key_prefixes(self.root_path, url_prefix),
+                *self.get_key_prefixes(webp_path, url_prefix),
+            )
+            self._remove_from_memory(lambda key: key.startswith(key_prefixes))
+        return sum(deleted)
+
+    def _remove_from_memory(self, is_removed: Callable[[str], bool]):
+        """Drops removed results from this process' memory cache"""
+        cache = self.memory_cache
+        if cache is None:
+            return
+
+        cache.remove_matching(
+            lambda key: key[0] == self.bucket_name and is_removed(key[1])
+        )
+
     async def get(self) -> ResultStorageResult:
         path = self.context.request.url
-        file_abspath = normalize_path(self.context, self.prefix, path)
+        file_abspath = self.normalize_key(self.prefix, path)
+        unsharded_path = self.get_unsharded_key(self.prefix, path)
 
         logger.debug("[RESULT_STORAGE] getting from %s", file_abspath)
 
-        exists = await self.object_exists(file_abspath)
-        if not exists:
+        stale_window = self.config.AWS_RESULT_STORAGE_STALE_WHILE_REVALIDATE
+        if stale_window and self._is_regeneration():
+            logger.debug("[RESULT_STORAGE] regenerating %s", file_abspath)
+            return None
+
+        cache = self.memory_cache
+        if cache is not None:
+            cached = cache.get((self.bucket_name, file_abspath))
+            if cached is not None:
+                self.context.metrics.incr("result_storage.memory_cache.hit")
+                return self._get_result(cached[1])
+            self.context.metrics.incr("result_storage.memory_cache.miss")
+
+        if not self._is_s3_available():
+            logger.debug("[RESULT_STORAGE] S3 unavailable, missing %s", file_abspath)
+            return None
+
+        if (
+            self.config.AWS_RESULT_STORAGE_REDIRECT_MODE
+            and self.context.request_handler is not None
+        ):
+            key = file_abspath
+            response = await self.find_object_metadata(key)
+            if response is None and unsharded_path is not None:
+                key = unsharded_path
+                response = await self.find_object_metadata(key)
+            if response is None:
+                logger.debug(
+                    "[RESULT_STORAGE] image not found at %s", file_abspath
+                )
+                return None
+            # Expired results go through get_data, which handles revalidation
+            if not self._is_expired(response["LastModified"]):
+                return await self._redirect(key, response)
+
+        expiration = self.config.STORAGE_EXPIRATION_SECONDS
+        if stale_window and expiration is not None:
+            expiration += stale_window
+        data = await self.get_data(
+            self.bucket_name,
+            file_abspath,
+            expiration=expiration,
+            fallback_path=unsharded_path,
+        )
+
+        if data.status_code == 404:
             logger.debug(
                 "[RESULT_STORAGE] image not found at %s", file_abspath
             )
             return None
 
-        status, body, last_modified = await self.get_data(
-            self.bucket_name, file_abspath
-        )
-
-        if status != 200 or self._is_expired(last_modified):
+        if (
+            data.status_code == 200
+            and stale_window
+            and self._is_expired(data.last_modified)
+        ):
+            logger.debug("[RESULT_STORAGE] serving stale %s", file_abspath)
+            self.context.metrics.incr("result_storage.stale")
+            self._regenerate(file_abspath)
+            return self._get_result(data)
+
+        if (
+            data.status_code == 410
+            and self.config.AWS_RESULT_STORAGE_REVALIDATE_EXPIRED
+        ):
+            data = await self._revalidate(data.key)
+
+        if data.status_code != 200:
             logger.debug(
-                "[RESULT_STORAGE] cached image has expired (status %s)", status
+                "[RESULT_STORAGE] cached image has expired (status %s)",
+                data.status_code,
             )
             return None
 
@@ -190,13 +636,169 @@ class Storage(BaseStorage, S3Client):
             "[RESULT_STORAGE] Image retrieved successfully at %s.",
             file_abspath,
         )
+        self._cache_in_memory(file_abspath, data)
+
+        return self._get_result(data)
+
+    def _get_regeneration_token(self, uri: str) -> str:
+        # Signed with the security key, so that any thumbor process
+        # behind the same address accepts it but clients can't forge it
+        return hmac.new(
+            self.context.server.security_key.encode(), uri.encode(), sha256
+        ).hexdigest()
+
+    def _is_regeneration(self) -> bool:
+        """Whether this request was made to generate a stale result again"""
+        handler = self.context.request_handler
+        if handler is None:
+            return False
+
+        token = handler.request.headers.get(REGENERATE_HEADER)
+        return token is not None and hmac.compare_digest(
+            token, self._get_regeneration_token(handler.request.uri)
+        )
+
+    def _regenerate(self, file_abspath: str):
+        """
+        Has thumbor generate a stale result again in the background,
+        by requesting it once more with the regeneration header. At most
+        one regeneration per result is in flight.
+        """
+        handler = self.context.request_handler
+        if handler is None:
+            return
+
+        key = (asyncio.get_running_loop(), self.bucket_name, file_abspath)
+        if key in Storage.__regenerations:
+            self.context.metrics.incr("result_storage.regeneration.deduplicated")
+            return
+
+        uri = handler.request.uri
+        headers = {REGENERATE_HEADER: self._get_regeneration_token(uri)}
+        if "Accept" in handler.request.headers:
+            headers["Accept"] = handler.request.headers["Accept"]
+        base_url = (
+            self.config.AWS_RESULT_STORAGE_REGENERATE_URL
+            or f"http://127.0.0.1:{self.context.server.port}"
+        )
+
+        regeneration = asyncio.ensure_future(
+            self._request_regeneration(f"{base_url.rstrip('/')}{uri}", headers)
+        )
+        Storage.__regenerations[key] = regeneration
+        regeneration.add_done_callback(
+            lambda _: Storage.__regenerations.pop(key, None)
+        )
+
+    async def _request_regeneration(self, url: str, headers: Dict[str, str]):
+        try:
+            response = await AsyncHTTPClient().fetch(
+                url,
+                headers=headers,
+                request_timeout=REGENERATE_TIMEOUT,
+                raise_error=False,
+            )
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning(
+                "[RESULT_STORAGE] failed to regenerate %s: %s", url, error
+            )
+            self.context.metrics.incr("result_storage.regeneration.failed")
+            return
+
+        if response.code >= 400:
+            logger.warning(
+                "[RESULT_STORAGE] failed to regenerate %s: status %s",
+                url,
+                response.code,
+            )
+            self.context.metrics.incr("result_storage.regeneration.failed")
+            return
+
+        self.context.metrics.incr("result_storage.regeneration.done")
+
+    async def _redirect(
+        self, file_abspath: str, response: Mapping[str, Any]
+    ) -> ResultStorageResult:
+        """
+        Points the client to the result in S3. thumbor writes the
+        returned (empty) result as the body of the redirect, caching it
+        for no longer than the URL stays valid.
+        """
+        url, valid_for = await self._get_redirect_url(file_abspath)
+        handler = self.context.request_handler
+        handler.set_status(302)
+        handler.set_header("Location", url)
+
+        max_age = self.context.request.max_age
+        if max_age is None:
+            max_age = self.config.MAX_AGE
+        if valid_for is not None and max_age and valid_for < max_age:
+            self.context.request.max_age = valid_for
+        self.context.metrics.incr("result_storage.redirect")
+        logger.debug("[RESULT_STORAGE] redirecting to %s", url)
+
+        return ResultStorageResult(
+            buffer=b"",
+            metadata={
+                "LastModified": response["LastModified"],
+                "ContentType": response.get("ContentType"),
+            },
+        )
+
+    async def _get_redirect_url(
+        self, file_abspath: str
+    ) -> Tuple[str, Optional[int]]:
+        """
+        URL to redirect clients to and the seconds it stays valid for,
+        None if it does not expire
+        """
+        if self.config.AWS_RESULT_STORAGE_REDIRECT_MODE != "presigned":
+            location = self.config.AWS_DEFAULT_LOCATION.format(
+                bucket_name=self.bucket_name
+            )
+            # Unlike get_location, keeps the key's leading slash
+            return f"{location.rstrip('/')}/{quote(file_abspath)}", None
+
+        cache = get_memory_cache(
+            "presigned_urls",
+            0,
+            self.config.AWS_RESULT_STORAGE_PRESIGNED_URL_CACHE_MAX_ENTRIES,
+        )
+        key = (self.endpoint_url, self.bucket_name, file_abspath)
+        cached = cache.get(key)
+        if cached is not None:
+            self.context.metrics.incr("result_storage.presigned_url.hit")
+            url, expires_at = cached[1]
+            return url, int(expires_at - time.time())
+        self.context.metrics.incr("result_storage.presigned_url.miss")
+
+        expiration = self.config.AWS_RESULT_STORAGE_PRESIGNED_URL_EXPIRATION
+        async with self.get_client() as client:
+            url = await client.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket_name, "Key": file_abspath},
+                ExpiresIn=expiration,
+            )
+        # Stop handing the URL out while it is still valid for a while
+        now = time.time()
+        cache.set(key, b"", (url, now + expiration), now + expiration * 0.9)
+        return url, expiration
+
+    def _get_result(self, data: S3Object) -> ResultStorageResult:
+        """
+        Builds the result from the metadata S3 returned, only
+        sniffing the image type of objects stored without one
+        """
+        content_type = data.content_type
+        if content_type in (None, "application/octet-stream"):
+            content_type = BaseEngine.get_mimetype(data.body)
 
         return ResultStorageResult(
-            buffer=body,
+            buffer=data.body,
             metadata={
-                "LastModified": last_modified.replace(tzinfo=timezone.utc),
-                "ContentLength": len(body),
-                "ContentType": BaseEngine.get_mimetype(body),
+                "LastModified": data.last_modified.replace(tzinfo=timezone.utc),
+                "ContentLength": data.content_length,
+                "ContentType": content_type,
             },
         )
 
@@ -205,10 +807,14 @@ class Storage(BaseStorage, S3Client):
         self,
     ) -> datetime:
         path = self.context.request.url
-        file_abspath = normalize_path(self.context, self.prefix, path)
+        file_abspath = self.normalize_key(self.prefix, path)
         logger.debug("[RESULT_STORAGE] getting from %s", file_abspath)
 
-        response = await self.get_object_metadata(file_abspath)
+        response = await self.find_object_metadata(
+            file_abspath, self.get_unsharded_key(self.prefix, path)
+        )
+        if response is None:
+            return None
         return datetime.strptime(
             response["ResponseMetadata"]["HTTPHeaders"]["last-modified"],
             "%a, %d %b %Y %H:%M:%S %Z",
@@ -8,21 +8,108 @@
 # http://www.opensource.org/licenses/mit-license
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
+import asyncio
+import copy
 import datetime
-from typing import Any, Dict, Mapping, Optional, Tuple
+import io
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from hashlib import sha256
+from types import SimpleNamespace
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
 
 from aiobotocore.client import AioBaseClient
 from aiobotocore.session import AioSession, get_session
-from botocore.config import Config as BotocoreConfig
+from botocore.exceptions import ClientError
 from thumbor.config import Config
 from thumbor.context import Context
 from thumbor.utils import logger
 
+from thumbor_aws.circuit_breaker import CircuitBreaker
+from thumbor_aws.client_pool import PooledClient
+from thumbor_aws.concurrency import ConcurrencyLimiter, get_limiter
+from thumbor_aws.hedging import HedgingPolicy, get_hedging_policy
+from thumbor_aws.memory_cache import MemoryCache, get_memory_cache
+from thumbor_aws.utils import (
+    MemoryViewReader,
+    get_shard_segments,
+    normalize_path,
+)
+
 _default = object()
 
+THROTTLING_ERROR_CODES = ("SlowDown", "Throttling", "RequestLimitExceeded")
+
+# Maximum number of keys S3 accepts in a DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+# Operations that don't change objects, prioritized by the concurrency limiter
+READ_OPERATIONS = frozenset(("get_object", "head_object", "list_objects_v2"))
+
+# Messages S3 calls are cancelled with, telling apart why they were given up
+HEDGE_LOST = "hedge lost"
+DEADLINE_EXCEEDED = "deadline exceeded"
+
+
+class S3Object:
+    """
+    Data and metadata of an object read by S3Client.get_data.
+
+    Unpacks as (status_code, body, last_modified), which is what
+    get_data returned before it exposed the rest of the metadata.
+    """
+
+    __slots__ = (
+        "status_code",
+        "body",
+        "last_modified",
+        "content_type",
+        "content_length",
+        "etag",
+        "metadata",
+        "key",
+    )
+
+    def __init__(
+        self,
+        status_code: int,
+        body: bytes,
+        last_modified: Optional[datetime.datetime] = None,
+        response: Optional[Mapping[str, Any]] = None,
+        key: Optional[str] = None,
+    ):
+        self.status_code = status_code
+        self.body = body
+        self.last_modified = last_modified
+        response = response or {}
+        self.content_type: Optional[str] = response.get("ContentType")
+        self.content_length = len(body)
+        self.etag: Optional[str] = response.get("ETag")
+        self.metadata: Dict[str, str] = response.get("Metadata", {})
+        self.key = key
+
+    def __iter__(self):
+        return iter((self.status_code, self.body, self.last_modified))
+
 
 class S3Client:
     __session: AioSession = None
+    __reads_in_flight: Dict[Tuple, asyncio.Future] = {}
+    __read_waiters: Counter = Counter()
+    coalesced_reads: int = 0
+    subsystem: str = "storage"
     context: Context = None
     configuration: Dict[str, object] = None
 
@@ -30,6 +117,21 @@ class S3Client:
         self.context = context
         self.configuration = {}
 
+    def detach(self) -> "S3Client":
+        """
+        Copy of this client for work that outlives the current request.
+        thumbor clears the request's context once it finished, so the
+        copy keeps its own reference to the config and metrics.
+        """
+        client = copy.copy(self)
+        client.context = SimpleNamespace(
+            config=self.context.config,
+            metrics=self.context.metrics,
+            request=getattr(self.context, "request", None),
+            request_handler=None,
+        )
+        return client
+
     @property
     def config(self) -> Config:
         """Thumbor config from context"""
@@ -89,32 +191,228 @@ class S3Client:
             S3Client.__session = get_session()
         return S3Client.__session
 
-    def get_client(self) -> AioBaseClient:
-        """Gets a connected client to use for S3"""
-        config = BotocoreConfig(
-            max_pool_connections=50,
-            retries={'max_attempts': 3, 'mode': 'adaptive'},
-            connect_timeout=10,
-            read_timeout=30,
+    def _get_transport_setting(self, name: str) -> Any:
+        """
+        Connection setting for this client's subsystem, e.g.
+        AWS_RESULT_STORAGE_READ_TIMEOUT for result storage
+        """
+        return self.configuration.get(
+            name.lower(),
+            getattr(self.config, f"AWS_{self.subsystem.upper()}_{name}"),
         )
 
-        return self.session.create_client(
-            "s3",
-            region_name=self.region_name,
-            aws_secret_access_key=self.secret_access_key,
-            aws_access_key_id=self.access_key_id,
-            endpoint_url=self.endpoint_url,
-            config=config,
+    @property
+    def key_shards(self) -> int:
+        """Number of shards keys of this client's subsystem are spread over"""
+        return self.configuration.get(
+            "key_shards",
+            getattr(self.config, f"AWS_{self.subsystem.upper()}_KEY_SHARDS", 0),
+        )
+
+    def normalize_key(self, prefix: str, path: str) -> str:
+        """Key of a thumbor path, sharded if enabled"""
+        return normalize_path(self.context, prefix, path, self.key_shards)
+
+    def get_unsharded_key(self, prefix: str, path: str) -> Optional[str]:
+        """
+        Key a thumbor path had before sharding was enabled,
+        if objects should still be looked for there
+        """
+        if self.key_shards <= 1 or not self.config.AWS_KEY_SHARDS_READ_FALLBACK:
+            return None
+        return normalize_path(self.context, prefix, path)
+
+    def get_keys(self, prefix: str, path: str) -> List[str]:
+        """Every key a thumbor path may be stored at"""
+        unsharded = self.get_unsharded_key(prefix, path)
+        keys = [self.normalize_key(prefix, path)]
+        return keys if unsharded is None else keys + [unsharded]
+
+    def get_key_prefixes(self, prefix: str, path: str) -> List[str]:
+        """Every prefix the keys of thumbor paths starting with path have"""
+        prefixes = [normalize_path(self.context, prefix, path)]
+        if self.key_shards <= 1:
+            return prefixes
+
+        key = normalize_path(self.context, "", path)
+        prefix = prefix.rstrip("/")
+        return prefixes + [
+            f"{prefix}/{segment}/{key}" if prefix else f"{segment}/{key}"
+            for segment in get_shard_segments(self.key_shards)
+        ]
+
+    @property
+    def botocore_options(self) -> Dict[str, Any]:
+        """Options used to build the botocore config of the client"""
+        max_attempts = self._get_transport_setting("MAX_ATTEMPTS")
+        if self.compatibility_mode and self.config.TC_AWS_MAX_RETRY:
+            max_attempts = self.config.TC_AWS_MAX_RETRY
+
+        return {
+            "max_pool_connections": self._get_transport_setting(
+                "MAX_POOL_CONNECTIONS"
+            ),
+            "retries": {
+                "max_attempts": max_attempts,
+                "mode": self._get_transport_setting("RETRY_MODE"),
+            },
+            "connect_timeout": self._get_transport_setting("CONNECT_TIMEOUT"),
+            "read_timeout": self._get_transport_setting("READ_TIMEOUT"),
+            "connector_args": {
+                "keepalive_timeout": self._get_transport_setting(
+                    "KEEPALIVE_TIMEOUT"
+                ),
+            },
+            "s3": {
+                "addressing_style": self._get_transport_setting(
+                    "ADDRESSING_STYLE"
+                ),
+            },
+        }
+
+    def get_client(self) -> PooledClient:
+        """
+        Gets a connected client to use for S3.
+
+        Clients are shared by every S3Client with the same region,
+        endpoint, credentials and options and stay open for the
+        lifetime of the IOLoop.
+        """
+        return PooledClient(
+            self.session,
+            {
+                "region_name": self.region_name,
+                "aws_secret_access_key": self.secret_access_key,
+                "aws_access_key_id": self.access_key_id,
+                "endpoint_url": self.endpoint_url,
+            },
+            self.botocore_options,
         )
 
+    @property
+    def is_optional(self) -> bool:
+        """
+        Whether requests can do without this client's S3 calls, as with
+        storage and result storage but not the loader
+        """
+        return self.subsystem != "loader"
+
+    def get_time_left(self) -> Optional[float]:
+        """
+        Seconds left until the deadline of the current request for this
+        client's S3 calls, or None if it has none
+        """
+        if self.is_optional:
+            deadline = self.config.AWS_OPTIONAL_DEADLINE
+        else:
+            deadline = self.config.AWS_MANDATORY_DEADLINE
+        if not deadline:
+            return None
+
+        started_at = getattr(self.context, "aws_request_started_at", None)
+        if started_at is None:
+            started_at = time.monotonic()
+            handler = self.context.request_handler
+            if handler is not None:
+                started_at -= handler.request.request_time()
+            # Every S3Client of the request measures from the same start
+            self.context.aws_request_started_at = started_at
+        return deadline - (time.monotonic() - started_at)
+
+    async def _within_deadline(
+        self, operation: Awaitable[Any], path: str, on_timeout: Callable[[], Any]
+    ) -> Any:
+        """
+        Awaits operation until the deadline of the current request,
+        returning on_timeout() if it is not done by then
+        """
+        time_left = self.get_time_left()
+        if time_left is None:
+            return await operation
+
+        task = asyncio.ensure_future(operation)
+        done = set()
+        try:
+            if time_left > 0:
+                done, _ = await asyncio.wait([task], timeout=time_left)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        if not done:
+            task.cancel(DEADLINE_EXCEEDED)
+            # Lets the S3 call record that it timed out before giving up on it
+            await asyncio.wait([task])
+            if task.cancelled():
+                logger.warning(
+                    "[S3_CLIENT] request deadline exceeded for %s", path
+                )
+                self.context.metrics.incr(
+                    f"s3.{self.subsystem}.deadline_exceeded"
+                )
+                return on_timeout()
+        return task.result()
+
     async def upload(
         self,
         path: str,
         data: bytes,
         content_type,
         default_location,
+        metadata: Optional[Dict[str, str]] = None,
+        skip_existing: bool = False,
+    ) -> str:
+        """
+        Uploads a File to S3, with optional user metadata.
+
+        With skip_existing, the upload is conditional on the object not
+        existing yet (If-None-Match: *). Uploads of objects that already
+        exist and have not expired are skipped, as are uploads of objects
+        this process wrote recently.
+
+        Optional uploads still running at the request's deadline are
+        given up on.
+        """
+
+        def on_timeout() -> str:
+            if not self.is_optional:
+                raise RuntimeError(
+                    f"Unable to upload image to {path}: deadline exceeded"
+                )
+            return self.get_location(path, default_location)
+
+        return await self._within_deadline(
+            self._upload(
+                path,
+                data,
+                content_type,
+                default_location,
+                metadata,
+                skip_existing,
+            ),
+            path,
+            on_timeout,
+        )
+
+    async def _upload(
+        self,
+        path: str,
+        data: bytes,
+        content_type,
+        default_location,
+        metadata: Optional[Dict[str, str]] = None,
+        skip_existing: bool = False,
     ) -> str:
-        """Uploads a File to S3"""
+        content_hash = None
+        if skip_existing:
+            if self.config.AWS_SKIP_EXISTING_UPLOADS_COMPARE_HASH:
+                content_hash = sha256(
+                    data.encode() if isinstance(data, str) else data
+                ).hexdigest()
+                metadata = {**(metadata or {}), "content-sha256": content_hash}
+            if self._was_recently_written(path, content_hash):
+                self._incr_upload_skipped()
+                return self.get_location(path, default_location)
 
         async with self.get_client() as client:
             response = None
@@ -127,8 +425,19 @@ class S3Client:
                 }
                 if self.file_acl is not None:
                     settings["ACL"] = self.file_acl
+                if metadata:
+                    settings["Metadata"] = metadata
 
-                response = await client.put_object(**settings)
+                if skip_existing:
+                    response = await self._put_if_absent(
+                        client, settings, content_hash
+                    )
+                    if response is None:
+                        self._incr_upload_skipped()
+                        self._forget_missing(self.bucket_name, path)
+                        return self.get_location(path, default_location)
+                else:
+                    response = await self._put(client, settings)
             except Exception as error:
                 msg = f"Unable to upload image to {path}: {error} ({type(error)})"
                 logger.error(msg)
@@ -139,58 +448,847 @@ class S3Client:
                 logger.error(msg)
                 raise RuntimeError(msg)
 
-            location = default_location.format(bucket_name=self.bucket_name)
+            self._forget_missing(self.bucket_name, path)
+            if skip_existing:
+                self._remember_written(path, content_hash)
+            return self.get_location(path, default_location)
 
-            return f"{location.rstrip('/')}/{path.lstrip('/')}"
+    async def _put(
+        self, client: AioBaseClient, settings: Dict[str, Any]
+    ) -> Mapping[str, Any]:
+        if self._should_upload_multipart(settings["Body"]):
+            return await self._upload_multipart(client, dict(settings))
+        return await self._call(client, "put_object", **settings)
+
+    async def _put_if_absent(
+        self,
+        client: AioBaseClient,
+        settings: Dict[str, Any],
+        content_hash: Optional[str],
+    ) -> Optional[Mapping[str, Any]]:
+        """
+        Puts an object unless S3 already has it. Returns None if the
+        upload was skipped. Existing objects that expired, or whose
+        content hash differs, are replaced.
+        """
+        try:
+            return await self._put(client, {**settings, "IfNoneMatch": "*"})
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "PreconditionFailed":
+                raise
+
+        existing = await self.find_object_metadata(settings["Key"])
+        if (
+            existing is not None
+            and not self._is_expired(existing["LastModified"])
+            and (
+                content_hash is None
+                or existing.get("Metadata", {}).get("content-sha256")
+                == content_hash
+            )
+        ):
+            return None
+
+        return await self._put(client, settings)
+
+    @property
+    def recently_written(self) -> Optional[MemoryCache]:
+        """Process-wide set of keys recently uploaded, if enabled"""
+        if not self.config.AWS_RECENTLY_WRITTEN_TTL:
+            return None
+
+        return get_memory_cache(
+            "recently_written", 0, self.config.AWS_RECENTLY_WRITTEN_MAX_ENTRIES
+        )
+
+    def _was_recently_written(
+        self, path: str, content_hash: Optional[str]
+    ) -> bool:
+        cache = self.recently_written
+        if cache is None:
+            return False
+
+        written = cache.get((self.endpoint_url, self.bucket_name, path))
+        return written is not None and (
+            content_hash is None or written[1] == content_hash
+        )
+
+    def _remember_written(self, path: str, content_hash: Optional[str]):
+        cache = self.recently_written
+        if cache is None:
+            return
+
+        now = time.time()
+        expires_at = now + self.config.AWS_RECENTLY_WRITTEN_TTL
+        if self.config.STORAGE_EXPIRATION_SECONDS is not None:
+            # Objects about to expire must be written again
+            expires_at = min(
+                expires_at, now + self.config.STORAGE_EXPIRATION_SECONDS
+            )
+        cache.set(
+            (self.endpoint_url, self.bucket_name, path),
+            b"",
+            content_hash,
+            expires_at,
+        )
+
+    def _forget_written(self, path: str):
+        cache = self.recently_written
+        if cache is not None:
+            cache.remove((self.endpoint_url, self.bucket_name, path))
+
+    def _incr_upload_skipped(self):
+        self.context.metrics.incr(f"s3.{self.subsystem}.upload.skipped")
+
+    async def delete_objects(self, keys: Iterable[str]) -> int:
+        """
+        Deletes keys with DeleteObjects, in batches of up to 1000 keys
+        sent concurrently. Returns the number of keys requested: S3
+        reports keys that did not exist as deleted too.
+        """
+
+        keys = list(dict.fromkeys(keys))
+        semaphore = asyncio.Semaphore(self.config.AWS_DELETE_CONCURRENCY)
+        async with self.get_client() as client:
+            results = await asyncio.gather(
+                *(
+                    self._delete_batch(
+                        client, keys[start : start + DELETE_BATCH_SIZE], semaphore
+                    )
+                    for start in range(0, len(keys), DELETE_BATCH_SIZE)
+                )
+            )
+        return self._count_deleted(results)
+
+    async def delete_path_prefix(
+        self, prefix: str, path: str, excluded: Iterable[str] = ()
+    ) -> int:
+        """
+        Deletes every object stored for thumbor paths starting with path,
+        in the unsharded layout and, if sharding is enabled, in every shard.
+        Returns the number of keys deleted.
+        """
+
+        unsharded = normalize_path(self.context, prefix, path)
+        if self.key_shards <= 1:
+            return await self.delete_prefix(unsharded, excluded)
+
+        key = normalize_path(self.context, "", path)
+        prefix = prefix.rstrip("/")
+        shard_prefixes = [
+            f"{prefix}/{segment}/" if prefix else f"{segment}/"
+            for segment in get_shard_segments(self.key_shards)
+        ]
+        deleted = await asyncio.gather(
+            # Sharded keys also start with the unsharded prefix of short paths
+            self.delete_prefix(unsharded, [*excluded, *shard_prefixes]),
+            *(
+                self.delete_prefix(f"{shard_prefix}{key}", excluded)
+                for shard_prefix in shard_prefixes
+            ),
+        )
+        return sum(deleted)
+
+    async def delete_prefix(
+        self, prefix: str, excluded: Iterable[str] = ()
+    ) -> int:
+        """
+        Deletes every object whose key starts with prefix but not with any
+        of the excluded prefixes, deleting each page of keys while the next
+        one is listed. Returns the number of keys deleted.
+        """
+
+        excluded = tuple(excluded)
+        semaphore = asyncio.Semaphore(self.config.AWS_DELETE_CONCURRENCY)
+        batches = []
+        async with self.get_client() as client:
+            settings = {"Bucket": self.bucket_name, "Prefix": prefix}
+            while True:
+                page = await self._call(client, "list_objects_v2", **settings)
+                keys = [
+                    item["Key"]
+                    for item in page.get("Contents", [])
+                    if not item["Key"].startswith(excluded)
+                ]
+                if keys:
+                    batches.append(
+                        asyncio.ensure_future(
+                            self._delete_batch(client, keys, semaphore)
+                        )
+                    )
+                if not page.get("IsTruncated"):
+                    break
+                settings["ContinuationToken"] = page["NextContinuationToken"]
+
+            results = await asyncio.gather(*batches)
+        return self._count_deleted(results)
+
+    async def _delete_batch(
+        self,
+        client: AioBaseClient,
+        keys: List[str],
+        semaphore: asyncio.Semaphore,
+    ) -> Tuple[int, List[Mapping[str, str]]]:
+        async with semaphore:
+            response = await self._call(
+                client,
+                "delete_objects",
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+            )
+
+        for key in keys:
+            self._forget_written(key)
+        errors = response.get("Errors", [])
+        return len(keys) - len(errors), errors
+
+    def _count_deleted(
+        self, results: List[Tuple[int, List[Mapping[str, str]]]]
+    ) -> int:
+        errors = [error for _, batch_errors in results for error in batch_errors]
+        if errors:
+            msg = (
+                f"Failed to remove {len(errors)} objects, e.g. "
+                f"{errors[0]['Key']}: {errors[0].get('Message')}"
+            )
+            logger.error(msg)
+            raise RuntimeError(msg)
+
+        return sum(deleted for deleted, _ in results)
+
+    def get_location(self, path: str, default_location: str) -> str:
+        """URL of an object uploaded to path"""
+        location = default_location.format(bucket_name=self.bucket_name)
+        return f"{location.rstrip('/')}/{path.lstrip('/')}"
+
+    def _should_upload_multipart(self, data: Any) -> bool:
+        threshold = self.config.AWS_MULTIPART_UPLOAD_THRESHOLD
+        return (
+            bool(threshold)
+            and isinstance(data, (bytes, bytearray, memoryview))
+            and len(data) >= threshold
+        )
+
+    async def _upload_multipart(
+        self, client: AioBaseClient, settings: Dict[str, Any]
+    ) -> Mapping[str, Any]:
+        """
+        Uploads settings["Body"] as a multipart upload, sending parts
+        concurrently. The upload is aborted if any part fails.
+        """
+        body = memoryview(settings.pop("Body"))
+        if_none_match = settings.pop("IfNoneMatch", None)
+        part_size = self.config.AWS_MULTIPART_UPLOAD_PART_SIZE
+        semaphore = asyncio.Semaphore(
+            self.config.AWS_MULTIPART_UPLOAD_CONCURRENCY
+        )
+        target = {"Bucket": settings["Bucket"], "Key": settings["Key"]}
+
+        upload = await self._call(
+            client, "create_multipart_upload", **settings
+        )
+        target["UploadId"] = upload["UploadId"]
+
+        async def upload_part(number: int, start: int) -> Dict[str, Any]:
+            async with semaphore:
+                response = await self._call(
+                    client,
+                    "upload_part",
+                    PartNumber=number,
+                    Body=MemoryViewReader(body[start : start + part_size]),
+                    **target,
+                )
+            return {"ETag": response["ETag"], "PartNumber": number}
+
+        parts = [
+            asyncio.ensure_future(upload_part(number, start))
+            for number, start in enumerate(
+                range(0, len(body), part_size), start=1
+            )
+        ]
+        try:
+            await asyncio.gather(*parts)
+            complete = {}
+            if if_none_match is not None:
+                complete["IfNoneMatch"] = if_none_match
+            return await self._call(
+                client,
+                "complete_multipart_upload",
+                MultipartUpload={"Parts": [part.result() for part in parts]},
+                **complete,
+                **target,
+            )
+        except BaseException:
+            for part in parts:
+                part.cancel()
+            try:
+                await asyncio.shield(
+                    self._call(client, "abort_multipart_upload", **target)
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error(
+                    "Unable to abort multipart upload to %s: %s",
+                    target["Key"],
+                    error,
+                )
+            raise
 
     async def get_data(
-        self, bucket: str, path: str, expiration: int = _default
-    ) -> Tuple[int, bytes, bytes, Optional[datetime.datetime]]:
-        """Gets an object's data from S3"""
+        self,
+        bucket: str,
+        path: str,
+        expiration: int = _default,
+        range_size: int = 0,
+        fallback_path: Optional[str] = None,
+    ) -> S3Object:
+        """
+        Gets an object's data from S3.
+
+        Concurrent reads of the same object share a single GetObject
+        request instead of each downloading it. If range_size is given,
+        objects bigger than it are downloaded as concurrent ranged GETs.
+        Objects not found at path are looked for at fallback_path.
+
+        Reads still running at the request's deadline have status 504.
+        """
+        return await self._within_deadline(
+            self._get_data_or_fallback(
+                bucket, path, expiration, range_size, fallback_path
+            ),
+            path,
+            lambda: S3Object(504, b"", key=path),
+        )
+
+    async def _get_data_or_fallback(
+        self,
+        bucket: str,
+        path: str,
+        expiration: int,
+        range_size: int,
+        fallback_path: Optional[str],
+    ) -> S3Object:
+        data = await self._get_data(bucket, path, expiration, range_size)
+        if data.status_code == 404 and fallback_path is not None:
+            data = await self._get_data(
+                bucket, fallback_path, expiration, range_size
+            )
+            if data.status_code != 404:
+                self.context.metrics.incr(f"s3.{self.subsystem}.key_fallback")
+        return data
+
+    async def _get_data(
+        self, bucket: str, path: str, expiration: int, range_size: int
+    ) -> S3Object:
+        if self._is_known_missing(bucket, path):
+            return S3Object(404, b"", key=path)
+
+        key = (
+            asyncio.get_running_loop(),
+            self.endpoint_url,
+            bucket,
+            path,
+            expiration,
+        )
+        in_flight = S3Client.__reads_in_flight.get(key)
+        if in_flight is not None:
+            S3Client.coalesced_reads += 1
+            self.context.metrics.incr(
+                f"s3.{self.subsystem}.get_data.coalesced"
+            )
+            return await self._wait_for_read(key, in_flight)
+
+        # The read may outlive the request that started it
+        in_flight = asyncio.ensure_future(
+            self.detach()._fetch_hedged(bucket, path, expiration, range_size)
+        )
+        S3Client.__reads_in_flight[key] = in_flight
+
+        def done(_):
+            S3Client._forget_read(key, in_flight)
+
+        in_flight.add_done_callback(done)
+        return await self._wait_for_read(key, in_flight)
+
+    async def _wait_for_read(
+        self, key: Tuple, in_flight: asyncio.Future
+    ) -> S3Object:
+        """
+        Waits for a read shared by concurrent callers. Callers giving up
+        on it (e.g. at their request's deadline) leave it to the others,
+        the last one to leave cancels it.
+        """
+        waiters = S3Client.__read_waiters
+        if not in_flight.done():
+            waiters[in_flight] += 1
+        try:
+            return await asyncio.shield(in_flight)
+        except asyncio.CancelledError as error:
+            if not in_flight.done():
+                waiters[in_flight] -= 1
+                if not waiters[in_flight]:
+                    # Later callers start a read of their own
+                    S3Client._forget_read(key, in_flight)
+                    in_flight.cancel(*error.args[:1])
+            raise
+
+    @staticmethod
+    def _forget_read(key: Tuple, in_flight: asyncio.Future):
+        if S3Client.__reads_in_flight.get(key) is in_flight:
+            del S3Client.__reads_in_flight[key]
+        S3Client.__read_waiters.pop(in_flight, None)
+
+    @property
+    def hedging_policy(self) -> Optional[HedgingPolicy]:
+        """Policy for hedging this client's GETs, if they are hedged"""
+        delay = self._get_transport_setting("HEDGE_DELAY")
+        percentile = self._get_transport_setting("HEDGE_PERCENTILE")
+        if not delay and not percentile:
+            return None
+        return get_hedging_policy(
+            self.subsystem,
+            delay,
+            percentile,
+            self._get_transport_setting("HEDGE_BUDGET"),
+        )
+
+    async def _fetch_hedged(
+        self, bucket: str, path: str, expiration: int, range_size: int
+    ) -> S3Object:
+        """
+        Fetches an object, sending a second identical GET if the first is
+        slow to respond. The first GET to succeed wins and the other one
+        is cancelled.
+        """
+        policy = self.hedging_policy
+        if policy is None:
+            return await self._fetch_data(bucket, path, expiration, range_size)
+
+        policy.start()
+        start = time.perf_counter()
+        cancel_message = HEDGE_LOST
+        attempts = [
+            asyncio.ensure_future(
+                self._fetch_data(bucket, path, expiration, range_size)
+            )
+        ]
+        try:
+            delay = policy.get_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and policy.try_hedge():
+                    self.context.metrics.incr(
+                        f"s3.{self.subsystem}.get_data.hedge.fired"
+                    )
+                    attempts.append(
+                        asyncio.ensure_future(
+                            self._fetch_data(bucket, path, expiration, range_size)
+                        )
+                    )
+                elif not done:
+                    self.context.metrics.incr(
+                        f"s3.{self.subsystem}.get_data.hedge.budget_exhausted"
+                    )
+            winner = await self._first_success(attempts)
+        except asyncio.CancelledError as error:
+            # e.g. at the request's deadline, which the attempts share
+            cancel_message = error.args[0] if error.args else None
+            raise
+        finally:
+            for attempt in attempts:
+                attempt.cancel(cancel_message)
+
+        policy.record(time.perf_counter() - start)
+        if winner is not attempts[0]:
+            self.context.metrics.incr(f"s3.{self.subsystem}.get_data.hedge.won")
+        return winner.result()
+
+    async def _first_success(self, attempts: List[asyncio.Future]) -> asyncio.Future:
+        """
+        Waits for the first attempt to succeed, or for every attempt to
+        fail, in which case the first one is returned
+        """
+        pending = set(attempts)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            succeeded = [
+                attempt
+                for attempt in attempts
+                if attempt in done and attempt.exception() is None
+            ]
+            if succeeded:
+                return succeeded[0]
+        return attempts[0]
+
+    async def _fetch_data(
+        self, bucket: str, path: str, expiration: int, range_size: int = 0
+    ) -> S3Object:
         async with self.get_client() as client:
+            settings = {"Bucket": bucket, "Key": path}
+            buffer = io.BytesIO()
+            if range_size:
+                settings["Range"] = f"bytes=0-{range_size - 1}"
+
             try:
-                response = await client.get_object(Bucket=bucket, Key=path)
+                # The connection is in use until the body was read, so the
+                # read holds its room in the subsystem's limit until then
+                async with self._slot("get_object"):
+                    response = await self._send(client, "get_object", **settings)
+                    data = await self._read_response(
+                        response, path, expiration, range_size, buffer
+                    )
             except client.exceptions.NoSuchKey:
-                return 404, b"", None
+                self._remember_missing(bucket, path)
+                return S3Object(404, b"", key=path)
+            except client.exceptions.ClientError as err:
+                # NOTE: This case is required because of https://github.com/boto/boto3/issues/2442
+                if err.response["Error"]["Code"] == "404":
+                    self._remember_missing(bucket, path)
+                    return S3Object(404, b"", key=path)
+                # Empty objects can't be requested by range
+                if err.response["Error"]["Code"] == "InvalidRange":
+                    return await self._fetch_data(bucket, path, expiration)
+                raise
 
-            status_code = self.get_status_code(response)
-            if status_code != 200:
-                msg = f"Unable to upload image to {path}: Status Code {status_code}"
-                logger.error(msg)
-                return status_code, msg, None
+            if data.status_code == 206:
+                try:
+                    await self._get_remaining_ranges(
+                        client, bucket, path, response, range_size, buffer
+                    )
+                except client.exceptions.ClientError as err:
+                    # The object changed since the first range was read
+                    if err.response["Error"]["Code"] != "PreconditionFailed":
+                        raise
+                    return await self._fetch_data(
+                        bucket, path, expiration, range_size
+                    )
+                body = buffer.getvalue()
+                return S3Object(200, body, data.last_modified, response, path)
+            return data
 
-            last_modified = response["LastModified"]
+    async def _read_response(
+        self,
+        response: Mapping[str, Any],
+        path: str,
+        expiration: int,
+        range_size: int,
+        buffer: io.BytesIO,
+    ) -> S3Object:
+        """
+        Reads the object in a GetObject response. Of ranged responses
+        (206) only the first range is read, into buffer, which is sized
+        to the whole object; the body is taken from it once it is filled.
+        """
+        status_code = self.get_status_code(response)
+        if status_code not in (200, 206):
+            msg = f"Unable to upload image to {path}: Status Code {status_code}"
+            logger.error(msg)
+            return S3Object(status_code, msg, key=path)
 
-            if self._is_expired(last_modified, expiration):
-                return 410, b"", last_modified
+        last_modified = response["LastModified"]
+        if self._is_expired(last_modified, expiration):
+            return S3Object(410, b"", last_modified, response, path)
 
+        if status_code == 206:
+            size = int(response["ContentRange"].rsplit("/", 1)[1])
+            buffer.seek(size - 1)
+            buffer.write(b"\0")
+            with buffer.getbuffer() as view:
+                await self._read_into(response["Body"], view[:range_size])
+            body = b""
+        else:
             body = await self.get_body(response)
+        return S3Object(status_code, body, last_modified, response, path)
 
-            return status_code, body, last_modified
-
-    async def object_exists(self, filepath: str):
+    async def object_exists(
+        self, filepath: str, fallback_path: Optional[str] = None
+    ):
         """Detects whether an object exists in S3"""
 
+        metadata = await self.find_object_metadata(filepath, fallback_path)
+        return metadata is not None
+
+    async def find_object_metadata(
+        self, filepath: str, fallback_path: Optional[str] = None
+    ) -> Optional[Mapping[str, Any]]:
+        """
+        Gets an object's metadata, or None if it does not exist
+        at filepath nor at fallback_path, or was not found by the
+        request's deadline
+        """
+        return await self._within_deadline(
+            self._find_object_metadata_or_fallback(filepath, fallback_path),
+            filepath,
+            lambda: None,
+        )
+
+    async def _find_object_metadata_or_fallback(
+        self, filepath: str, fallback_path: Optional[str]
+    ) -> Optional[Mapping[str, Any]]:
+        response = await self._find_object_metadata(filepath)
+        if response is None and fallback_path is not None:
+            response = await self._find_object_metadata(fallback_path)
+            if response is not None:
+                self.context.metrics.incr(f"s3.{self.subsystem}.key_fallback")
+        return response
+
+    async def _find_object_metadata(
+        self, filepath: str
+    ) -> Optional[Mapping[str, Any]]:
+        if self._is_known_missing(self.bucket_name, filepath):
+            return None
+
         async with self.get_client() as client:
             try:
-                await client.head_object(Bucket=self.bucket_name, Key=filepath)
-                return True
+                return await self._call(
+                    client, "head_object", Bucket=self.bucket_name, Key=filepath
+                )
             except client.exceptions.NoSuchKey:
-                return False
+                self._remember_missing(self.bucket_name, filepath)
+                return None
             except client.exceptions.ClientError as err:
                 # NOTE: This case is required because of https://github.com/boto/boto3/issues/2442
                 if err.response["Error"]["Code"] == "404":
+                    self._remember_missing(self.bucket_name, filepath)
+                    return None
+                raise
+
+    @property
+    def negative_cache(self) -> Optional[MemoryCache]:
+        """Process-wide cache of keys known to be missing, if enabled"""
+        if not self.config.AWS_NEGATIVE_CACHE_TTL:
+            return None
+
+        return get_memory_cache(
+            "negative", 0, self.config.AWS_NEGATIVE_CACHE_MAX_ENTRIES
+        )
+
+    def _is_known_missing(self, bucket: str, path: str) -> bool:
+        cache = self.negative_cache
+        if cache is None:
+            return False
+
+        if cache.get((self.endpoint_url, bucket, path)) is None:
+            self.context.metrics.incr(f"s3.{self.subsystem}.negative_cache.miss")
+            return False
+
+        self.context.metrics.incr(f"s3.{self.subsystem}.negative_cache.hit")
+        return True
+
+    def _remember_missing(self, bucket: str, path: str):
+        cache = self.negative_cache
+        if cache is None:
+            return
+
+        evicted = cache.set(
+            (self.endpoint_url, bucket, path),
+            b"",
+            None,
+            time.time() + self.config.AWS_NEGATIVE_CACHE_TTL,
+        )
+        if evicted:
+            self.context.metrics.incr(
+                f"s3.{self.subsystem}.negative_cache.eviction", evicted
+            )
+
+    def _forget_missing(self, bucket: str, path: str):
+        cache = self.negative_cache
+        if cache is not None:
+            cache.remove((self.endpoint_url, bucket, path))
+
+    async def is_modified_since(
+        self,
+        bucket: str,
+        path: str,
+        last_modified: datetime.datetime,
+        modified_on_timeout: bool = True,
+    ) -> bool:
+        """
+        Conditionally checks an object with If-Modified-Since.
+        Objects that no longer exist count as modified, and objects
+        not checked by the request's deadline as modified_on_timeout.
+        """
+        return await self._within_deadline(
+            self._is_modified_since(bucket, path, last_modified),
+            path,
+            lambda: modified_on_timeout,
+        )
+
+    async def _is_modified_since(
+        self, bucket: str, path: str, last_modified: datetime.datetime
+    ) -> bool:
+        async with self.get_client() as client:
+            try:
+                await self._call(
+                    client,
+                    "head_object",
+                    Bucket=bucket,
+                    Key=path,
+                    IfModifiedSince=last_modified,
+                )
+                return True
+            except client.exceptions.ClientError as err:
+                code = err.response["Error"]["Code"]
+                if code == "304":
                     return False
+                if code in ("404", "NoSuchKey"):
+                    return True
                 raise
 
+    async def refresh(self, filepath: str, response: Mapping[str, Any]):
+        """
+        Resets an object's LastModified by copying it onto itself,
+        keeping the metadata and content type from a HEAD response.
+        """
+
+        async with self.get_client() as client:
+            settings = {
+                "Bucket": self.bucket_name,
+                "Key": filepath,
+                "CopySource": {"Bucket": self.bucket_name, "Key": filepath},
+                "MetadataDirective": "REPLACE",
+                "Metadata": response.get("Metadata", {}),
+                "ContentType": response.get(
+                    "ContentType", "application/octet-stream"
+                ),
+            }
+            if self.file_acl is not None:
+                settings["ACL"] = self.file_acl
+
+            await self._call(client, "copy_object", **settings)
+
     async def get_object_metadata(self, filepath: str):
         """Gets an object's metadata"""
 
         async with self.get_client() as client:
-            return await client.head_object(
-                Bucket=self.bucket_name, Key=filepath
+            return await self._call(
+                client, "head_object", Bucket=self.bucket_name, Key=filepath
             )
 
+    @property
+    def circuit_breaker(self) -> Optional[CircuitBreaker]:
+        """
+        Circuit breaker the outcome of this client's S3 calls is
+        recorded in, if any
+        """
+        return None
+
+    @property
+    def limiter(self) -> Optional[ConcurrencyLimiter]:
+        """
+        Limiter of the S3 requests this client's subsystem has in
+        flight, if they are limited
+        """
+        limit = self._get_transport_setting("MAX_CONCURRENT_REQUESTS")
+        write_limit = self._get_transport_setting("MAX_CONCURRENT_WRITES")
+        if not limit and not write_limit:
+            return None
+        return get_limiter(self.subsystem, limit, write_limit)
+
+    async def _call(
+        self, client: AioBaseClient, operation: str, **kwargs
+    ) -> Mapping[str, Any]:
+        """
+        Calls an S3 API operation, waiting for room if the subsystem's
+        requests are limited
+        """
+        async with self._slot(operation):
+            return await self._send(client, operation, **kwargs)
+
+    @asynccontextmanager
+    async def _slot(self, operation: str) -> AsyncIterator[None]:
+        """
+        Holds room for a request of operation while in the context,
+        waiting for it if the subsystem's requests are limited
+        """
+        limiter = self.limiter
+        if limiter is None:
+            yield
+            return
+
+        kind = "read" if operation in READ_OPERATIONS else "write"
+        start = time.perf_counter()
+        async with limiter.slot(kind == "write"):
+            self.context.metrics.timing(
+                f"s3.{self.subsystem}.{kind}.queue_wait",
+                (time.perf_counter() - start) * 1000,
+            )
+            yield
+
+    async def _send(
+        self, client: AioBaseClient, operation: str, **kwargs
+    ) -> Mapping[str, Any]:
+        """
+        Sends an S3 API request, recording its latency, status, bytes
+        transferred, retries and throttling through thumbor's metrics
+        """
+        start = time.perf_counter()
+        response = {}
+        status = "error"
+        try:
+            response = await getattr(client, operation)(**kwargs)
+            status = self.get_status_code(response)
+            return response
+        except ClientError as error:
+            response = error.response
+            status = response.get("ResponseMetadata", {}).get(
+                "HTTPStatusCode", response.get("Error", {}).get("Code")
+            )
+            if response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+                self._incr_metric(operation, kwargs.get("Bucket"), "throttled")
+            raise
+        except asyncio.CancelledError as error:
+            status = "cancelled"
+            if HEDGE_LOST in error.args:
+                status = "hedge_lost"
+            elif DEADLINE_EXCEEDED in error.args:
+                status = "timeout"
+            raise
+        finally:
+            self._record_call(operation, kwargs, response, status, start)
+
+    def _record_call(
+        self,
+        operation: str,
+        kwargs: Mapping[str, Any],
+        response: Mapping[str, Any],
+        status: Any,
+        start: float,
+    ):
+        bucket = kwargs.get("Bucket")
+        seconds = time.perf_counter() - start
+        self.context.metrics.timing(
+            self._get_metric_name(operation, bucket, "latency"), seconds * 1000
+        )
+        self._incr_metric(operation, bucket, f"status.{status}")
+
+        breaker = self.circuit_breaker
+        # The losing attempt of a hedged GET is no sign of S3 failing
+        if breaker is not None and status != "hedge_lost":
+            breaker.record(breaker.is_failure(status, seconds))
+
+        retries = response.get("ResponseMetadata", {}).get("RetryAttempts")
+        if retries:
+            self._incr_metric(operation, bucket, "retries", retries)
+
+        transferred = len(kwargs.get("Body") or b"")
+        if operation == "get_object":
+            transferred = response.get("ContentLength", 0)
+        if transferred:
+            self._incr_metric(operation, bucket, "bytes", transferred)
+
+    def _incr_metric(
+        self, operation: str, bucket: str, name: str, value: int = 1
+    ):
+        self.context.metrics.incr(
+            self._get_metric_name(operation, bucket, name), value
+        )
+
+    def _get_metric_name(self, operation: str, bucket: str, name: str) -> str:
+        bucket = (bucket or "unknown").replace(".", "_")
+        return f"s3.{self.subsystem}.{operation}.{bucket}.{name}"
+
     def get_status_code(self, response: Mapping[str, Any]) -> int:
         """Gets the status code from an AWS response object"""
         if (
@@ -201,9 +1299,17 @@ class S3Client:
         return response["ResponseMetadata"]["HTTPStatusCode"]
 
     async def get_body(self, response: Any) -> bytes:
-        """Gets the body from an AWS response object"""
+        """
+        Gets the body from an AWS response object.
+
+        Bodies of known length are read in chunks straight into a single
+        buffer of that length, instead of being joined from copies.
+        """
         stream = response["Body"]
+        size = response.get("ContentLength")
         try:
+            if size:
+                return await self._read_body(stream, size)
             async with stream:
                 return await stream.read()
         except Exception as error:
@@ -215,6 +1321,70 @@ class S3Client:
             logger.error("Error reading response body: %s", error)
             raise
 
+    async def _get_remaining_ranges(
+        self,
+        client: AioBaseClient,
+        bucket: str,
+        path: str,
+        response: Mapping[str, Any],
+        range_size: int,
+        buffer: io.BytesIO,
+    ):
+        """
+        Fetches the ranges after the first one, which is in response,
+        concurrently into buffer.
+        """
+        size = buffer.getbuffer().nbytes
+        semaphore = asyncio.Semaphore(
+            self.config.AWS_LOADER_RANGED_GET_CONCURRENCY
+        )
+
+        async def read_range(start: int):
+            end = min(start + range_size, size)
+            async with semaphore, self._slot("get_object"):
+                part = await self._send(
+                    client,
+                    "get_object",
+                    Bucket=bucket,
+                    Key=path,
+                    Range=f"bytes={start}-{end - 1}",
+                    IfMatch=response["ETag"],
+                )
+                await self._read_into(part["Body"], view[start:end])
+
+        # The view must be released before the body is taken from buffer
+        with buffer.getbuffer() as view:
+            await asyncio.gather(
+                *(read_range(start) for start in range(range_size, size, range_size))
+            )
+
+    async def _read_body(self, stream: Any, size: int) -> bytes:
+        """Reads a body of size bytes from stream without copying it"""
+        # BytesIO.getvalue() hands over its internal bytes object when the
+        # buffer is exactly filled, so the body is never copied into bytes
+        buffer = io.BytesIO()
+        buffer.seek(size - 1)
+        buffer.write(b"\0")
+        with buffer.getbuffer() as view:
+            read = await self._read_into(stream, view)
+        buffer.truncate(read)
+        return buffer.getvalue()
+
+    async def _read_into(self, stream: Any, view: memoryview) -> int:
+        """
+        Reads stream into view, in chunks so that no intermediate
+        buffer is larger than AWS_BODY_READ_CHUNK_SIZE
+        """
+        chunk_size = self.config.AWS_BODY_READ_CHUNK_SIZE or len(view)
+        offset = 0
+        async with stream:
+            while offset < len(view):
+                read = await stream.readinto(view[offset : offset + chunk_size])
+                if not read:
+                    break
+                offset += read
+        return offset
+
     def _get_bucket_and_path(self, path) -> Tuple[str, str]:
         bucket = self.bucket_name
         real_path = path
@@ -9,15 +9,15 @@
 # Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
 
 from json import dumps, loads
-from typing import Any
+from typing import Any, Dict, Iterable, Mapping, Optional
+from urllib.parse import quote, unquote
 
 from thumbor import storages
 from thumbor.engines import BaseEngine
 from thumbor.utils import logger
 
-from thumbor_aws.config import Config
+from thumbor_aws.config import Config, define_transport_settings
 from thumbor_aws.s3_client import S3Client
-from thumbor_aws.utils import normalize_path
 
 
 Config.define(
@@ -69,11 +69,41 @@ Config.define(
     "AWS Storage",
 )
 
+Config.define(
+    "AWS_STORAGE_SIDECARS_IN_METADATA",
+    False,
+    "Stores the security key and detector data of an image in its S3 "
+    "metadata instead of in separate .txt and .detectors.txt objects. "
+    "Existing separate objects are still read.",
+    "AWS Storage",
+)
+
+Config.define(
+    "AWS_STORAGE_KEY_SHARDS",
+    0,
+    "When greater than 1, storage keys get a leading segment derived from a "
+    "hash of the key, spreading them over this many prefixes so that S3 "
+    "can serve more requests without throttling. Defaults to 0 (unsharded).",
+    "AWS Storage",
+)
+
+define_transport_settings("AWS_STORAGE", "AWS Storage")
+
+CRYPTO_METADATA_KEY = "thumbor-crypto"
+DETECTORS_METADATA_KEY = "thumbor-detectors"
+
+# Objects stored for each image: the image, its crypto and its detector data
+SIDECAR_SUFFIXES = ("", ".txt", ".detectors.txt")
+
+# S3 limits the user metadata of an object to 2KB
+MAX_METADATA_SIZE = 2048
+
 
 class Storage(storages.BaseStorage, S3Client):
     def __init__(self, context):
         S3Client.__init__(self, context)
         storages.BaseStorage.__init__(self, context)
+        self.heads: Dict[str, Optional[Mapping[str, Any]]] = {}
         if self.compatibility_mode:
             self.configuration["region_name"] = self.config.TC_AWS_REGION
             self.configuration["endpoint_url"] = self.config.TC_AWS_ENDPOINT
@@ -92,16 +122,41 @@ class Storage(storages.BaseStorage, S3Client):
             self.config.AWS_STORAGE_ROOT_PATH,
         )
 
+    @property
+    def sidecars_in_metadata(self) -> bool:
+        """Whether crypto and detector data are kept in the image's metadata"""
+        return self.config.AWS_STORAGE_SIDECARS_IN_METADATA
+
     async def put(self, path: str, file_bytes: bytes) -> str:
         content_type = BaseEngine.get_mimetype(file_bytes)
-        normalized_path = normalize_path(self.context, self.root_path, path)
+        normalized_path = self.normalize_key(self.root_path, path)
         logger.debug("[STORAGE] putting at %s", normalized_path)
+
+        metadata = {}
+        if (
+            self.sidecars_in_metadata
+            and self.context.config.STORES_CRYPTO_KEY_FOR_EACH_IMAGE
+            and self.context.server.security_key
+        ):
+            metadata[CRYPTO_METADATA_KEY] = quote(
+                self.context.server.security_key
+            )
+
+        skip_existing = self.config.AWS_SKIP_EXISTING_UPLOADS
         path = await self.upload(
             normalized_path,
             file_bytes,
             content_type,
             self.context.config.AWS_DEFAULT_LOCATION,
+            metadata=metadata,
+            skip_existing=skip_existing,
         )
+        # A skipped upload leaves the existing object's metadata in place
+        if self.sidecars_in_metadata and not skip_existing:
+            self.heads[normalized_path] = {
+                "Metadata": metadata,
+                "ContentType": content_type,
+            }
         return path
 
     async def put_crypto(self, path: str) -> str:
@@ -114,7 +169,17 @@ class Storage(storages.BaseStorage, S3Client):
                 "True if no SECURITY_KEY specified"
             )
 
-        normalized_path = normalize_path(self.context, self.root_path, path)
+        normalized_path = self.normalize_key(self.root_path, path)
+        if self.sidecars_in_metadata and await self._put_in_metadata(
+            normalized_path,
+            CRYPTO_METADATA_KEY,
+            quote(self.context.server.security_key),
+        ):
+            logger.debug("Stored crypto in metadata of %s", normalized_path)
+            return self.get_location(
+                normalized_path, self.context.config.AWS_DEFAULT_LOCATION
+            )
+
         crypto_path = f"{normalized_path}.txt"
         key = self.context.server.security_key.encode()
         s3_path = await self.upload(
@@ -129,9 +194,16 @@ class Storage(storages.BaseStorage, S3Client):
         return s3_path
 
     async def put_detector_data(self, path: str, data: Any) -> str:
-        normalized_path = normalize_path(self.context, self.root_path, path)
-        filepath = f"{normalized_path}.detectors.txt"
+        normalized_path = self.normalize_key(self.root_path, path)
         details = dumps(data)
+        if self.sidecars_in_metadata and await self._put_in_metadata(
+            normalized_path, DETECTORS_METADATA_KEY, quote(details)
+        ):
+            return self.get_location(
+                normalized_path, self.context.config.AWS_DEFAULT_LOCATION
+            )
+
+        filepath = f"{normalized_path}.detectors.txt"
         return await self.upload(
             filepath,
             details,
@@ -140,9 +212,11 @@ class Storage(storages.BaseStorage, S3Client):
         )
 
     async def get(self, path: str) -> bytes:
-        normalized_path = normalize_path(self.context, self.root_path, path)
+        normalized_path = self.normalize_key(self.root_path, path)
         status, body, _ = await self.get_data(
-            self.bucket_name, normalized_path
+            self.bucket_name,
+            normalized_path,
+            fallback_path=self.get_unsharded_key(self.root_path, path),
         )
         if status != 200:
             return None
@@ -150,40 +224,141 @@ class Storage(storages.BaseStorage, S3Client):
         return body
 
     async def get_crypto(self, path: str) -> str:
-        normalized_path = normalize_path(self.context, self.root_path, path)
-        crypto_path = f"{normalized_path}.txt"
-        status, body, _ = await self.get_data(self.bucket_name, crypto_path)
+        normalized_path = self.normalize_key(self.root_path, path)
+        unsharded_path = self.get_unsharded_key(self.root_path, path)
+        if self.sidecars_in_metadata:
+            found, value = await self._get_from_metadata(
+                normalized_path, CRYPTO_METADATA_KEY, unsharded_path
+            )
+            if found:
+                return value
+
+        status, body, _ = await self.get_data(
+            self.bucket_name,
+            f"{normalized_path}.txt",
+            fallback_path=unsharded_path and f"{unsharded_path}.txt",
+        )
         if status != 200:
             return None
 
         return body.decode("utf-8")
 
     async def get_detector_data(self, path: str) -> Any:
-        normalized_path = normalize_path(self.context, self.root_path, path)
-        detector_path = f"{normalized_path}.detectors.txt"
-        status, body, _ = await self.get_data(self.bucket_name, detector_path)
+        normalized_path = self.normalize_key(self.root_path, path)
+        unsharded_path = self.get_unsharded_key(self.root_path, path)
+        if self.sidecars_in_metadata:
+            found, value = await self._get_from_metadata(
+                normalized_path, DETECTORS_METADATA_KEY, unsharded_path
+            )
+            if found:
+                return None if value is None else loads(value)
+
+        status, body, _ = await self.get_data(
+            self.bucket_name,
+            f"{normalized_path}.detectors.txt",
+            fallback_path=unsharded_path and f"{unsharded_path}.detectors.txt",
+        )
         if status != 200:
             return None
 
         return loads(body)
 
     async def exists(self, path: str) -> bool:
-        normalized_path = normalize_path(self.context, self.root_path, path)
-        return await self.object_exists(normalized_path)
+        normalized_path = self.normalize_key(self.root_path, path)
+        return await self.object_exists(
+            normalized_path, self.get_unsharded_key(self.root_path, path)
+        )
 
     async def remove(self, path: str):
-        exists = await self.exists(path)
-        if not exists:
-            return
-
-        async with self.get_client() as client:
-            normalized_path = normalize_path(self.context, self.root_path, path)
-            response = await client.delete_object(
-                Bucket=self.bucket_name,
-                Key=normalized_path,
-            )
-            status = self.get_status_code(response)
-            if status >= 300:
-                raise RuntimeError(
-                    f"Failed to remove {normalized_path}: Status {status}"
+        await self.remove_many([path])
+
+    async def remove_many(self, paths: Iterable[str]) -> int:
+        """
+        Removes images along with their crypto and detector objects,
+        in bulk. Returns the number of keys requested, including the
+        crypto and detector keys of images that have none.
+        """
+        keys = []
+        for path in paths:
+            for normalized_path in self.get_keys(self.root_path, path):
+                self.heads.pop(normalized_path, None)
+                keys.extend(
+                    f"{normalized_path}{suffix}" for suffix in SIDECAR_SUFFIXES
                 )
+        return await self.delete_objects(keys)
+
+    async def purge(self, path_prefix: str) -> int:
+        """
+        Removes every image whose path starts with path_prefix, along
+        with their crypto and detector objects. Returns the number of
+        keys deleted.
+        """
+        self.heads.clear()
+        return await self.delete_path_prefix(self.root_path, path_prefix)
+
+    async def _get_head(self, normalized_path: str) -> Optional[Mapping[str, Any]]:
+        """
+        HEAD response of an image, fetched once per storage instance.
+        None when the image does not exist.
+        """
+        if normalized_path not in self.heads:
+            self.heads[normalized_path] = await self.find_object_metadata(
+                normalized_path
+            )
+        return self.heads[normalized_path]
+
+    async def _get_from_metadata(
+        self,
+        normalized_path: str,
+        name: str,
+        unsharded_path: Optional[str] = None,
+    ):
+        """
+        Reads a value kept in an image's metadata. Returns whether it
+        was answered from metadata, which is also the case for missing
+        images, and the value.
+        """
+        head = await self._get_head(normalized_path)
+        if head is None and unsharded_path is not None:
+            head = await self._get_head(unsharded_path)
+        if head is None:
+            return True, None
+
+        value = head.get("Metadata", {}).get(name)
+        if value is None:
+            return False, None
+        return True, unquote(value)
+
+    async def _put_in_metadata(
+        self, normalized_path: str, name: str, value: str
+    ) -> bool:
+        """
+        Adds a value to an image's metadata, copying the image onto itself.
+        Returns False if the image does not exist or the metadata would
+        not fit, in which case a separate object should be used.
+        """
+        head = await self._get_head(normalized_path)
+        if head is None:
+            return False
+
+        metadata = dict(head.get("Metadata", {}))
+        if metadata.get(name) == value:
+            return True
+
+        metadata[name] = value
+        size = sum(
+            len(key.encode()) + len(val.encode())
+            for key, val in metadata.items()
+        )
+        if size > MAX_METADATA_SIZE:
+            logger.debug(
+                "[STORAGE] %s does not fit in metadata of %s",
+                name,
+                normalized_path,
+            )
+            return False
+
+        head = {**head, "Metadata": metadata}
+        await self.refresh(normalized_path, head)
+        self.heads[normalized_path] = head
+        return True
@@ -0,0 +1,463 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+"""
+In-memory stand-in for S3, for testing and measuring thumbor-aws without
+localstack.
+
+It replaces S3Client.get_client, so every extension talks to it instead
+of S3, and can add latency and errors to its responses:
+
+    fake = FakeS3(latency=0.005, error_rate=0.01)
+    with fake.installed():
+        ...
+
+Only the parts of the S3 API used by thumbor-aws are implemented.
+"""
+
+import asyncio
+import datetime
+import random
+from collections import Counter
+from contextlib import contextmanager
+from email.utils import format_datetime
+from hashlib import md5
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+
+from thumbor_aws.s3_client import S3Client
+
+
+class NoSuchKey(ClientError):
+    pass
+
+
+class BucketAlreadyOwnedByYou(ClientError):
+    pass
+
+
+class FakeObject:
+    __slots__ = ("body", "content_type", "metadata", "last_modified", "etag")
+
+    def __init__(
+        self,
+        body: bytes,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Mapping[str, str]] = None,
+    ):
+        self.body = body
+        self.content_type = content_type
+        self.metadata = dict(metadata or {})
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc)
+        self.etag = f'"{md5(body).hexdigest()}"'  # nosec
+
+
+class FakeStream:
+    """Body of a GetObject response, read like aiobotocore's StreamingBody"""
+
+    def __init__(self, data: memoryview):
+        self.data = data
+        self.position = 0
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def read(self, amt: Optional[int] = None) -> bytes:
+        end = len(self.data) if amt is None else self.position + amt
+        chunk = bytes(self.data[self.position : end])
+        self.position += len(chunk)
+        return chunk
+
+    async def readinto(self, buffer) -> int:
+        chunk = self.data[self.position : self.position + len(buffer)]
+        buffer[: len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeS3:
+    """
+    Buckets kept in memory, served through FakeS3Client.
+
+    Every request waits latency seconds, plus the time to transfer its
+    body at bandwidth bytes per second if given. A share of requests
+    given by error_rate fails with error_code, and fail() and
+    slow_down() make the next requests of an operation fail or slow.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        error_rate: float = 0.0,
+        error_code: str = "SlowDown",
+        error_status: int = 503,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.buckets: Dict[str, Dict[str, FakeObject]] = {}
+        self.uploads: Dict[str, Tuple[Dict[int, bytes], Mapping[str, Any]]] = {}
+        self.failures: Dict[str, List[Tuple[str, int]]] = {}
+        self.delays: Dict[str, List[float]] = {}
+        self.calls: Counter = Counter()
+
+    @contextmanager
+    def installed(self) -> Iterator["FakeS3"]:
+        """Makes every S3Client use this fake instead of S3"""
+        original = S3Client.get_client
+        S3Client.get_client = lambda _: FakeClientContext(self)
+        try:
+            yield self
+        finally:
+            S3Client.get_client = original
+
+    def create_bucket(self, bucket: str):
+        """Creates a bucket without going through the client"""
+        self.buckets.setdefault(bucket, {})
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        body: bytes,
+        content_type: str = "application/octet-stream",
+        metadata: Optional[Mapping[str, str]] = None,
+    ):
+        """Stores an object without going through the client"""
+        self.buckets.setdefault(bucket, {})[key] = FakeObject(
+            bytes(body), content_type, metadata
+        )
+
+    def fail(
+        self,
+        operation: str,
+        code: str = "InternalError",
+        status: int = 500,
+        count: int = 1,
+    ):
+        """Makes the next count requests of operation fail"""
+        self.failures.setdefault(operation, []).extend([(code, status)] * count)
+
+    def slow_down(self, operation: str, seconds: float, count: int = 1):
+        """Makes the next count requests of operation take seconds longer"""
+        self.delays.setdefault(operation, []).extend([seconds] * count)
+
+    def get_object_or_none(self, bucket: str, key: str) -> Optional[FakeObject]:
+        return self.buckets.get(bucket, {}).get(key)
+
+    async def request(self, operation: str, size: int = 0):
+        """Applies latency and injected errors to a request"""
+        self.calls[operation] += 1
+        delay = self.latency
+        if self.bandwidth:
+            delay += size / self.bandwidth
+        if self.delays.get(operation):
+            delay += self.delays[operation].pop(0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        failures = self.failures.get(operation)
+        if failures:
+            raise error(*failures.pop(0))
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise error(self.error_code, self.error_status)
+
+
+def error(code: str, status: int, error_class: type = ClientError) -> ClientError:
+    return error_class(
+        {
+            "Error": {"Code": code, "Message": code},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        },
+        "FakeS3",
+    )
+
+
+def response(status: int = 200, **fields) -> Dict[str, Any]:
+    return {
+        "ResponseMetadata": {
+            "HTTPStatusCode": status,
+            "HTTPHeaders": {},
+            "RetryAttempts": 0,
+        },
+        **fields,
+    }
+
+
+def to_bytes(body: Any) -> bytes:
+    if isinstance(body, str):
+        return body.encode()
+    if hasattr(body, "read"):
+        return body.read()
+    return bytes(body)
+
+
+class FakeClientContext:
+    """Async context manager yielding a client of a FakeS3"""
+
+    def __init__(self, s3: FakeS3):
+        self.s3 = s3
+
+    async def __aenter__(self) -> "FakeS3Client":
+        return FakeS3Client(self.s3)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class FakeS3Client:
+    """The subset of aiobotocore's S3 client used by thumbor-aws"""
+
+    exceptions = SimpleNamespace(
+        ClientError=ClientError,
+        NoSuchKey=NoSuchKey,
+        BucketAlreadyOwnedByYou=BucketAlreadyOwnedByYou,
+    )
+
+    def __init__(self, s3: FakeS3):
+        self.s3 = s3
+
+    def _get(self, bucket: str, key: str, head: bool = False) -> FakeObject:
+        obj = self.s3.get_object_or_none(bucket, key)
+        if obj is None:
+            # HEAD responses have no body, so S3 can't tell which error it was
+            raise error("404", 404) if head else error("NoSuchKey", 404, NoSuchKey)
+        return obj
+
+    def _describe(self, obj: FakeObject, status: int = 200, **fields):
+        described = response(
+            status,
+            ContentType=obj.content_type,
+            ContentLength=len(obj.body),
+            ETag=obj.etag,
+            LastModified=obj.last_modified,
+            Metadata=dict(obj.metadata),
+        )
+        described["ResponseMetadata"]["HTTPHeaders"]["last-modified"] = (
+            format_datetime(obj.last_modified, usegmt=True)
+        )
+        described.update(fields)
+        return described
+
+    async def create_bucket(self, Bucket: str, **_):
+        await self.s3.request("create_bucket")
+        if Bucket in self.s3.buckets:
+            raise error(
+                "BucketAlreadyOwnedByYou", 409, BucketAlreadyOwnedByYou
+            )
+        self.s3.buckets[Bucket] = {}
+        return response()
+
+    async def get_object(
+        self,
+        Bucket: str,
+        Key: str,
+        Range: Optional[str] = None,
+        IfMatch: Optional[str] = None,
+        **_,
+    ):
+        obj = self.s3.get_object_or_none(Bucket, Key)
+        size = len(obj.body) if obj is not None else 0
+        start, end = 0, size
+        if Range is not None:
+            start, _, last = Range[len("bytes="):].partition("-")
+            start, end = int(start), min(int(last) + 1, size)
+        await self.s3.request("get_object", max(end - start, 0))
+
+        obj = self._get(Bucket, Key)
+        if IfMatch is not None and IfMatch != obj.etag:
+            raise error("PreconditionFailed", 412)
+        view = memoryview(obj.body)
+        if Range is None:
+            return self._describe(obj, Body=FakeStream(view))
+
+        if start >= size:
+            raise error("InvalidRange", 416)
+        return self._describe(
+            obj,
+            206,
+            Body=FakeStream(view[start:end]),
+            ContentLength=end - start,
+            ContentRange=f"bytes {start}-{end - 1}/{size}",
+        )
+
+    async def head_object(
+        self,
+        Bucket: str,
+        Key: str,
+        IfModifiedSince: Optional[datetime.datetime] = None,
+        **_,
+    ):
+        await self.s3.request("head_object")
+        obj = self._get(Bucket, Key, head=True)
+        if IfModifiedSince is not None and obj.last_modified <= IfModifiedSince:
+            raise error("304", 304)
+        return self._describe(obj)
+
+    def _store(
+        self,
+        bucket: str,
+        key: str,
+        body: bytes,
+        content_type: Optional[str] = None,
+        metadata: Optional[Mapping[str, str]] = None,
+        if_none_match: Optional[str] = None,
+    ) -> FakeObject:
+        if if_none_match == "*" and self.s3.get_object_or_none(bucket, key):
+            raise error("PreconditionFailed", 412)
+        if bucket not in self.s3.buckets:
+            raise error("NoSuchBucket", 404)
+        obj = FakeObject(
+            body, content_type or "application/octet-stream", metadata
+        )
+        self.s3.buckets[bucket][key] = obj
+        return obj
+
+    async def put_object(
+        self,
+        Bucket: str,
+        Key: str,
+        Body: Any,
+        ContentType: Optional[str] = None,
+        Metadata: Optional[Mapping[str, str]] = None,
+        IfNoneMatch: Optional[str] = None,
+        **_,
+    ):
+        body = to_bytes(Body)
+        await self.s3.request("put_object", len(body))
+        obj = self._store(
+            Bucket, Key, body, ContentType, Metadata, IfNoneMatch
+        )
+        return response(ETag=obj.etag)
+
+    async def copy_object(
+        self,
+        Bucket: str,
+        Key: str,
+        CopySource: Mapping[str, str],
+        MetadataDirective: str = "COPY",
+        ContentType: Optional[str] = None,
+        Metadata: Optional[Mapping[str, str]] = None,
+        **_,
+    ):
+        await self.s3.request("copy_object")
+        source = self._get(CopySource["Bucket"], CopySource["Key"])
+        if MetadataDirective != "REPLACE":
+            ContentType, Metadata = source.content_type, source.metadata
+        obj = self._store(Bucket, Key, source.body, ContentType, Metadata)
+        return response(CopyObjectResult={"ETag": obj.etag})
+
+    async def delete_objects(self, Bucket: str, Delete: Mapping[str, Any], **_):
+        await self.s3.request("delete_objects")
+        objects = self.s3.buckets.get(Bucket, {})
+        deleted = []
+        for item in Delete["Objects"]:
+            objects.pop(item["Key"], None)
+            deleted.append({"Key": item["Key"]})
+        if Delete.get("Quiet"):
+            return response()
+        return response(Deleted=deleted)
+
+    async def list_objects_v2(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        ContinuationToken: Optional[str] = None,
+        MaxKeys: int = 1000,
+        **_,
+    ):
+        await self.s3.request("list_objects_v2")
+        keys = sorted(
+            key
+            for key in self.s3.buckets.get(Bucket, {})
+            if key.startswith(Prefix)
+            and (ContinuationToken is None or key > ContinuationToken)
+        )
+        page = keys[:MaxKeys]
+        fields = {"IsTruncated": len(keys) > MaxKeys, "KeyCount": len(page)}
+        if page:
+            fields["Contents"] = [{"Key": key} for key in page]
+        if fields["IsTruncated"]:
+            fields["NextContinuationToken"] = page[-1]
+        return response(**fields)
+
+    async def create_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        ContentType: Optional[str] = None,
+        Metadata: Optional[Mapping[str, str]] = None,
+        **_,
+    ):
+        await self.s3.request("create_multipart_upload")
+        upload_id = uuid4().hex
+        self.s3.uploads[upload_id] = (
+            {},
+            {"content_type": ContentType, "metadata": Metadata},
+        )
+        return response(Bucket=Bucket, Key=Key, UploadId=upload_id)
+
+    async def upload_part(
+        self, UploadId: str, PartNumber: int, Body: Any, **_
+    ):
+        body = to_bytes(Body)
+        await self.s3.request("upload_part", len(body))
+        if UploadId not in self.s3.uploads:
+            raise error("NoSuchUpload", 404)
+        self.s3.uploads[UploadId][0][PartNumber] = body
+        return response(ETag=f'"{md5(body).hexdigest()}"')  # nosec
+
+    async def complete_multipart_upload(
+        self,
+        Bucket: str,
+        Key: str,
+        UploadId: str,
+        MultipartUpload: Mapping[str, Any],
+        IfNoneMatch: Optional[str] = None,
+        **_,
+    ):
+        await self.s3.request("complete_multipart_upload")
+        upload = self.s3.uploads.pop(UploadId, None)
+        if upload is None:
+            raise error("NoSuchUpload", 404)
+        parts, settings = upload
+        body = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+        obj = self._store(Bucket, Key, body, if_none_match=IfNoneMatch, **settings)
+        return response(ETag=obj.etag)
+
+    async def abort_multipart_upload(self, UploadId: str, **_):
+        await self.s3.request("abort_multipart_upload")
+        self.s3.uploads.pop(UploadId, None)
+        return response(204)
+
+    async def generate_presigned_url(
+        self, ClientMethod: str, Params: Mapping[str, str], ExpiresIn: int = 3600
+    ) -> str:
+        return (
+            f"https://{Params['Bucket']}.fake-s3/{Params['Key'].lstrip('/')}"
+            f"?X-Amz-Expires={ExpiresIn}&X-Amz-Signature={uuid4().hex}"
+        )
@@ -1,13 +1,38 @@
+import io
+from hashlib import sha256
+from typing import List
+
 from thumbor.utils import logger
 
 
-def normalize_path(context, prefix: str, path: str) -> str:
+def get_shard(path: str, shards: int) -> str:
+    """Short hex segment spreading keys over shards by a hash of path"""
+    digest = int.from_bytes(sha256(path.encode("utf-8")).digest()[:4], "big")
+    return _format_shard(digest % shards, shards)
+
+
+def get_shard_segments(shards: int) -> List[str]:
+    """Every segment get_shard can return for this number of shards"""
+    return [_format_shard(shard, shards) for shard in range(shards)]
+
+
+def _format_shard(shard: int, shards: int) -> str:
+    width = len(f"{shards - 1:x}")
+    return f"{shard:0{width}x}"
+
+
+def normalize_path(context, prefix: str, path: str, shards: int = 0) -> str:
     """Convert a URL received from Thumbor to a key in a S3 bucket."""
     # Thumbor calls load/store functions with a URL that is  URL-encoded and
     # that always starts with a slash. S3Client doesn't expect URL-encoding
     # and S3 keys don't usually start with a slash. Decode and remove slash.
     new_path = context.config.AWS_NORMALIZER(path)
 
+    if shards > 1:
+        # Keys under different leading segments are spread over more S3
+        # partitions, so they get more request throughput.
+        new_path = f"{get_shard(new_path, shards)}/{new_path}"
+
     if prefix:
         # Avoid double slash if prefix ends with a slash.
         prefix = prefix.rstrip("/")
@@ -16,3 +41,44 @@ def normalize_path(context, prefix: str, path: str) -> str:
     logger.debug("[NORMALIZER] '%s' -> '%s'", path, new_path)
 
     return new_path
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Seekable, read-only file over a memoryview.
+
+    botocore only accepts bytes or file-like bodies, so this lets a slice
+    of a larger buffer be sent without copying it first.
+    """
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self.view = view.cast("B")
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self.view[self.position : self.position + len(buffer)]
+        size = len(chunk)
+        buffer[:size] = chunk
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def __len__(self) -> int:
+        return len(self.view)
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# thumbor aws extensions
+# https://github.com/thumbor/thumbor-aws
+
+# Licensed under the MIT license:
+# http://www.opensource.org/licenses/mit-license
+# Copyright (c) 2021 Bernardo Heynemann heynemann@gmail.com
+
+import asyncio
+import atexit
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from thumbor.utils import logger
+
+_queues: Dict[asyncio.AbstractEventLoop, "WriteBehindQueue"] = {}
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of pending S3 writes drained by a pool of workers.
+
+    Writes are identified by a key: enqueueing a key that is still
+    pending replaces its write instead of queueing it twice. When the
+    queue is full, callers wait up to max_wait seconds for room and the
+    write is dropped after that.
+    """
+
+    def __init__(self, max_size: int, workers: int):
+        self.queue: asyncio.Queue = asyncio.Queue(max_size)
+        self.pending: Dict[
+            Hashable, Tuple[Callable[[], Awaitable], float, Any]
+        ] = {}
+        self.workers: List[asyncio.Task] = [
+            asyncio.ensure_future(self._work()) for _ in range(workers)
+        ]
+
+    @property
+    def depth(self) -> int:
+        """Number of writes waiting to be made"""
+        return len(self.pending)
+
+    async def put(
+        self,
+        key: Hashable,
+        write: Callable[[], Awaitable],
+        metrics: Any,
+        max_wait: float,
+    ) -> bool:
+        """
+        Queues write() to be awaited by a worker.
+        Returns False if the write was dropped.
+        """
+        if key in self.pending:
+            _, enqueued_at, _ = self.pending[key]
+            self.pending[key] = (write, enqueued_at, metrics)
+            metrics.incr("result_storage.write_behind.deduplicated")
+        else:
+            self.pending[key] = (write, time.perf_counter(), metrics)
+            try:
+                self.queue.put_nowait(key)
+            except asyncio.QueueFull:
+                await self._wait_for_room(key, metrics, max_wait)
+            else:
+                metrics.incr("result_storage.write_behind.enqueued")
+
+        self._report_depth(metrics)
+        return key in self.pending
+
+    def _report_depth(self, metrics: Any):
+        # thumbor's metrics have no gauges, the depth is sent as a timing
+        metrics.timing("result_storage.write_behind.depth", self.depth)
+
+    async def _wait_for_room(self, key: Hashable, metrics: Any, max_wait: float):
+        try:
+            if not max_wait:
+                raise asyncio.TimeoutError()
+            await asyncio.wait_for(self.queue.put(key), max_wait)
+        except asyncio.TimeoutError:
+            self.pending.pop(key, None)
+            metrics.incr("result_storage.write_behind.dropped")
+            logger.warning("[WRITE_BEHIND] queue full, dropped %s", key)
+            return
+
+        metrics.incr("result_storage.write_behind.enqueued")
+
+    async def flush(self):
+        """Waits until every queued write was made"""
+        await self.queue.join()
+
+    async def close(self):
+        """Flushes the queue and stops the workers"""
+        await self.flush()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    async def _work(self):
+        while True:
+            key = await self.queue.get()
+            write, enqueued_at, metrics = self.pending.pop(key)
+            metrics.timing(
+                "result_storage.write_behind.lag",
+                (time.perf_counter() - enqueued_at) * 1000,
+            )
+            self._report_depth(metrics)
+            try:
+                await write()
+                metrics.incr("result_storage.write_behind.written")
+            except Exception as error:  # pylint: disable=broad-except
+                metrics.incr("result_storage.write_behind.failed")
+                logger.error("[WRITE_BEHIND] failed to write %s: %s", key, error)
+            finally:
+                self.queue.task_done()
+
+
+def get_write_behind_queue(max_size: int, workers: int) -> WriteBehindQueue:
+    """Gets the write-behind queue of the running event loop"""
+    loop = asyncio.get_running_loop()
+
+    for stale in [item for item in _queues if item.is_closed()]:
+        del _queues[stale]
+
+    queue = _queues.get(loop)
+    if queue is None:
+        queue = _queues[loop] = WriteBehindQueue(max_size, workers)
+    return queue
+
+
+async def flush_write_behind():
+    """Flushes and stops the write-behind queue of the running event loop"""
+    queue = _queues.pop(asyncio.get_running_loop(), None)
+    if queue is not None:
+        await queue.close()
+
+
+def _flush_at_exit():
+    # atexit runs handlers in reverse order of registration. This module is
+    # always imported after thumbor_aws.client_pool, so pending writes are
+    # flushed before the S3 clients they need are closed.
+    for loop, queue in list(_queues.items()):
+        if loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(queue.close())
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("[WRITE_BEHIND] failed to flush writes: %s", error)
+    _queues.clear()
+
+
+atexit.register(_flush_at_exit)